@@ -0,0 +1,229 @@
+# =========================================================================
+# 📦 OA 일괄 번역 CLI (Streamlit 없이 폴더 단위로 야간 처리)
+#
+#   python batch.py <입력 폴더> [-o 출력 폴더] [--jobs 2] [--workers 4] [--stub]
+#
+# - 입력 폴더에서 OABASE####_A_E / OABASE####_B_K (.pdf/.docx) 쌍을 찾아 사건별로 처리
+# - 헤더 필드는 B_K 원문/A_E에서 추출하며, <입력 폴더>/OABASE####_header.json 이 있으면 그 값을 우선 사용
+# - 블록 번역 결과는 출력 폴더의 .checkpoints/OABASE####.json 에 즉시 기록되어, 중단 후 다시 실행하면 이어서 처리
+# - 결과: OABASE####_C_E.docx + batch_report.json / batch_report.csv (토큰, 비용, 소요 시간)
+#         + telemetry.jsonl (호출·단계별 이벤트 로그, 실행마다 누적)
+# =========================================================================
+import os
+import re
+import csv
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pipeline import (
+    TEMPERATURE, MAX_INPUT_TOKENS, MAX_OUTPUT_TOKENS,
+    read_docx, read_pdf, preclean_bk, pretranslate_bk, prepare_blocks, header_block_index, extract_header_fields, pack_blocks, packing_report,
+    Telemetry, TermIndex, TranslationCache, RequestScheduler, StubClient, translate_cached, translate_all,
+    DocxBuilder, paragraph_fingerprints, extract_images, collect_images,
+)
+
+CASE_PAT = re.compile(r"^(OABASE\d+)_(A_E|B_K)\.(?:pdf|docx)$", re.IGNORECASE)
+
+def find_cases(input_dir: str) -> dict:
+    # {접두어: {"A_E": 경로, "B_K": 경로}} - 짝이 맞지 않는 사건은 경고 후 제외
+    cases = {}
+    for name in sorted(os.listdir(input_dir)):
+        m = CASE_PAT.match(name)
+        if m:
+            cases.setdefault(m.group(1).upper(), {})[m.group(2).upper()] = os.path.join(input_dir, name)
+    for prefix, paths in list(cases.items()):
+        if len(paths) < 2:
+            print(f"[건너뜀] {prefix}: A_E/B_K 쌍이 없습니다 ({', '.join(paths)})", file=sys.stderr)
+            del cases[prefix]
+    return cases
+
+def read_document(path: str) -> str:
+    return read_docx(path) if path.lower().endswith(".docx") else read_pdf(path)
+
+class Checkpoint:
+    # 블록 캐시 키 → 번역문. 블록이 끝날 때마다 임시 파일에 쓰고 교체하여 중간에 죽어도 파일이 깨지지 않음
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = json.load(f)
+
+    def get(self, key: str):
+        return self.done.get(key)
+
+    def put(self, key: str, translation: str):
+        with self.lock:
+            self.done[key] = translation
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.done, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+def load_header(input_dir: str, prefix: str, raw_bk: str, ae_text: str) -> dict:
+    header = extract_header_fields(raw_bk, ae_text)
+    override = os.path.join(input_dir, f"{prefix}_header.json")
+    if os.path.exists(override):
+        with open(override, encoding="utf-8") as f:
+            header.update(json.load(f))
+    return header
+
+def run_case(prefix: str, paths: dict, args, client, cache) -> dict:
+    start = time.perf_counter()
+    report = {"case": prefix, "status": "ok", "error": ""}
+    telemetry = Telemetry(prefix, os.path.join(args.output_dir, "telemetry.jsonl"))
+    with telemetry.stage("parse"):
+        ae_text = read_document(paths["A_E"])
+        raw_bk = read_document(paths["B_K"])
+    with telemetry.stage("image_prepare"):
+        # 표/도면은 번역하지 않고 원본 이미지를 표식 위치에 그대로 삽입
+        with open(paths["B_K"], "rb") as f:
+            bk_images = collect_images(extract_images(f.read(), paths["B_K"]))
+    header = load_header(args.input_dir, prefix, raw_bk, ae_text)
+    with telemetry.stage("split"):
+        split_blocks, header_hint = prepare_blocks(pretranslate_bk(preclean_bk(raw_bk)), header)
+        blocks = split_blocks if args.no_pack else pack_blocks(split_blocks, args.max_input_tokens, args.max_output_tokens)
+    packing = packing_report(split_blocks, blocks)
+    print(f"  {prefix}: API 호출 예정 {packing['calls_after']}회 (묶기 전 {packing['calls_before']}회), "
+          f"시스템 프롬프트 오버헤드 약 {packing['overhead_after']:,} 토큰")
+    with telemetry.stage("term_index"):
+        term_index = TermIndex(ae_text)
+
+    header_block_idx = header_block_index(blocks, header_hint)
+
+    docx_builder = DocxBuilder(bk_images)
+    checkpoint = Checkpoint(os.path.join(args.output_dir, ".checkpoints", f"{prefix}.json"))
+    results = {i: b["fixed"] for i, b in enumerate(blocks) if b["fixed"] is not None}
+    resumed = []
+
+    def run_block(job) -> str:
+        block, hint, label = job
+        ae_context = term_index.context_for(block, args.term_budget)
+        key = TranslationCache.make_key(block, ae_context, hint, args.model, TEMPERATURE)
+        done = checkpoint.get(key)
+        if done is not None:
+            resumed.append(label)
+            return done
+        translation = translate_cached(cache, client, args.model, ae_context, hint, block, telemetry=telemetry, label=label)
+        checkpoint.put(key, translation)
+        return translation
+
+    jobs = {
+        i: (b["src"], header_hint if i == header_block_idx else "", f"블록 {i + 1}")
+        for i, b in enumerate(blocks) if b["fixed"] is None
+    }
+    errors = []
+    with telemetry.stage("translate"):
+        for i, translation, err in translate_all(run_block, jobs, args.workers):
+            if err is None:
+                results[i] = translation
+                docx_builder.sync(results)
+            else:
+                errors.append(f"블록 {i + 1}: {err}")
+
+    # 공유 캐시를 쓰면 앱에서 정정 통지서를 올렸을 때 바뀐 블록만 다시 번역할 수 있도록 블록 구성도 저장
+    if cache is not None and header["app_no"]:
+        cache.save_document(header["app_no"], paragraph_fingerprints(split_blocks, header_hint), blocks, results)
+
+    if errors:
+        report.update(status="failed", error=" | ".join(errors))
+    else:
+        with telemetry.stage("docx_export"):
+            with open(os.path.join(args.output_dir, f"{prefix}_C_E.docx"), "wb") as f:
+                docx_builder.sync(results)
+                f.write(docx_builder.to_bytes())
+
+    summary = telemetry.summary()
+    report.update({
+        "blocks": len(blocks),
+        "local_blocks": len(blocks) - len(jobs),
+        "planned_calls": packing["calls_after"],
+        "unpacked_calls": packing["calls_before"],
+        "api_calls": summary["calls"],
+        "resumed_blocks": len(resumed),
+        "prompt_tokens": summary["prompt_tokens"],
+        "completion_tokens": summary["completion_tokens"],
+        "cached_tokens": summary["cached_tokens"],
+        "cost_usd": summary["cost_usd"],
+        "avg_latency_s": summary["avg_latency_s"],
+        "avg_queue_s": summary["avg_queue_s"],
+        "wall_s": round(time.perf_counter() - start, 2),
+        **{f"{stage}_s": sec for stage, sec in summary["stages"].items()},
+    })
+    return report
+
+def write_report(reports: list, output_dir: str):
+    with open(os.path.join(output_dir, "batch_report.json"), "w", encoding="utf-8") as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+    fields = list(dict.fromkeys(k for r in reports for k in r))
+    with open(os.path.join(output_dir, "batch_report.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(reports)
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="OABASE A_E/B_K 쌍을 폴더 단위로 일괄 번역하여 C_E.docx를 생성합니다.")
+    p.add_argument("input_dir", help="OABASE####_A_E / _B_K 파일이 있는 폴더")
+    p.add_argument("-o", "--output-dir", help="결과 폴더 (기본: 입력 폴더)")
+    p.add_argument("--model", default=os.environ.get("MODEL_NAME", "gpt-4o"))
+    p.add_argument("--jobs", type=int, default=2, help="동시에 처리할 사건 수")
+    p.add_argument("--workers", type=int, default=4, help="사건당 동시 블록 요청 수")
+    p.add_argument("--rpm", type=int, default=60, help="전체 사건이 공유하는 분당 최대 요청 수")
+    p.add_argument("--tpm", type=int, default=0, help="전체 사건이 공유하는 분당 최대 토큰 수 (0=제한 없음)")
+    p.add_argument("--timeout", type=float, default=120.0, help="요청당 타임아웃(초)")
+    p.add_argument("--max-retries", type=int, default=4, help="429/5xx/타임아웃 재시도 횟수")
+    p.add_argument("--fallback-model", default=os.environ.get("FALLBACK_MODEL_NAME"), help="주 모델 한도 소진 시 사용할 보조 모델")
+    p.add_argument("--term-budget", type=int, default=600, help="블록당 A_E 용어 컨텍스트 토큰 예산")
+    p.add_argument("--max-input-tokens", type=int, default=MAX_INPUT_TOKENS, help="요청당 최대 입력 토큰 (블록 묶기)")
+    p.add_argument("--max-output-tokens", type=int, default=MAX_OUTPUT_TOKENS, help="요청당 최대 출력 토큰 (약 2쪽)")
+    p.add_argument("--no-pack", action="store_true", help="번호 단락을 묶지 않고 하나씩 요청")
+    p.add_argument("--cache", help="번역 캐시 SQLite 경로 (지정 시 app.py와 같은 캐시를 공유)")
+    p.add_argument("--force", action="store_true", help="이미 C_E.docx가 있는 사건도 다시 처리")
+    p.add_argument("--stub", action="store_true", help="OpenAI 대신 로컬 대역 클라이언트 사용 (오프라인 테스트)")
+    p.add_argument("--stub-latency", type=float, default=0.0, help="대역 클라이언트의 호출당 지연(초)")
+    args = p.parse_args(argv)
+    args.output_dir = args.output_dir or args.input_dir
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.makedirs(os.path.join(args.output_dir, ".checkpoints"), exist_ok=True)
+    if args.stub:
+        client = StubClient(latency=args.stub_latency)
+    else:
+        from openai import OpenAI
+        client = OpenAI(max_retries=0)  # OPENAI_API_KEY 환경 변수 사용, 재시도는 스케줄러가 담당
+    # 모든 사건이 하나의 스케줄러(RPM/TPM 한도)를 공유
+    client = RequestScheduler(client, rpm=args.rpm, tpm=args.tpm, timeout=args.timeout,
+                              max_retries=args.max_retries, fallback_model=args.fallback_model)
+    cache = TranslationCache(args.cache) if args.cache else None
+
+    cases = find_cases(args.input_dir)
+    if not args.force:
+        cases = {p: c for p, c in cases.items() if not os.path.exists(os.path.join(args.output_dir, f"{p}_C_E.docx"))}
+    print(f"{len(cases)}건 처리 시작 (jobs={args.jobs}, workers={args.workers}, rpm={args.rpm}, model={args.model})")
+
+    reports = []
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        futures = {pool.submit(run_case, prefix, paths, args, client, cache): prefix for prefix, paths in cases.items()}
+        for fut in as_completed(futures):
+            try:
+                report = fut.result()
+            except Exception as e:
+                report = {"case": futures[fut], "status": "failed", "error": str(e)}
+            reports.append(report)
+            print(f"[{report['status']}] {report['case']}: 호출 {report.get('api_calls', 0)}회, "
+                  f"${report.get('cost_usd', 0):.4f}, {report.get('wall_s', 0)}s {report['error']}")
+
+    reports.sort(key=lambda r: r["case"])
+    print(f"스케줄러: {client.snapshot()}")
+    write_report(reports, args.output_dir)
+    return 1 if any(r["status"] != "ok" for r in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
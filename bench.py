@@ -0,0 +1,289 @@
+# =========================================================================
+# ⏱️ OA 파이프라인 오프라인 벤치마크 (API 비용·네트워크 지터 없이 성능 회귀 확인)
+#
+#   python bench.py [-o bench_results.json] [--sizes 10,40,160] [--concurrency 1,4,8] [--latency 0.2]
+#   python bench.py --baseline bench_results.json   # 이전 결과 대비 느려졌거나 호출 수가 늘면 종료 코드 1
+#
+# - 번호 단락 수가 커지는 합성 OA 문서(B_K: DOCX, A_E: 직접 작성한 최소 PDF)를 만들어
+#   파싱 → 전처리 → 번호 단락 분할 → 블록 묶기 → 번역(StubClient) → DOCX 출력까지 그대로 실행
+# - 모델은 StubClient(첫 토큰 지연, 스트리밍 조각 지연, n번째 호출마다 429)로 대신하고 RequestScheduler를 거쳐 호출
+# - 단계별 시간·최대 메모리(tracemalloc), API 호출 수, 동시 요청 수별 예상 전체 소요 시간을 JSON으로 기록
+# =========================================================================
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+from docx import Document
+
+from pipeline import (
+    INSTRUCTION_HASH, MAX_INPUT_TOKENS, MAX_OUTPUT_TOKENS,
+    read_docx, read_pdf, preclean_bk, split_into_numbered_blocks, pretranslate_bk, prepare_blocks, header_block_index, extract_header_fields,
+    pack_blocks, packing_report, Telemetry, TermIndex, RequestScheduler, StubClient, translate_cached, translate_all,
+    DocxBuilder,
+)
+
+# --- 합성 문서 ---
+_TERMS = [("필터층", 12), ("지지층", 14), ("부직포", 16), ("접착층", 18), ("주름 구조", 20), ("하우징", 22)]
+_EN_TERMS = ["filter layer", "support layer", "nonwoven", "adhesive layer", "pleated structure", "housing"]
+
+def synthetic_bk(paragraphs: int) -> str:
+    # 실제 통지서 구조(헤더 → 도입 문구 → 심사결과 → 번호 단락 → 참고사항 → 첨부 → 안내)를 흉내 낸 국문 본문
+    lines = [
+        "발송번호 : 9-5-2025-012345678",
+        "발송일자 : 2025.11.10",
+        "제출기일 : 2026.03.10",
+        "출원번호 : 10-2024-0001234",
+        "출원인 성명 HYDAC FILTERTECHNIK GMBH",
+        "이 출원에 대한 심사결과 아래와 같은 거절이유가 있어 특허법 제63조에 따라 이를 통지 하오니 의견이 있거나 "
+        "보정이 필요할 경우에는 상기 제출기일까지 의견서 및 보정서를 제출하여 주시기 바랍니다.",
+        "상기 제출기일에 대하여 매회 1개월 단위로 연장을 신청할 수 있으며, 4개월을 초과하여 연장하려는 경우에는 연장신청을 해야 합니다.",
+        "[심사결과]",
+        f"심사대상청구항 : 제1항 내지 제{paragraphs}항",
+        "구체적인 거절이유",
+    ]
+    for n in range(1, paragraphs + 1):
+        term, num = _TERMS[n % len(_TERMS)]
+        sentence = (f"이 출원의 청구항 {n}에 기재된 {term}({num})은 인용발명 {n % 3 + 1}의 식별번호 [{n % 90 + 10:04d}]에 "
+                    f"개시되어 있으므로 통상의 기술자라면 쉽게 발명할 수 있다. ")
+        lines.append(f"{n}. " + sentence * (1 + n % 4))
+        if n % 5 == 0:
+            lines.append(f"(1) 청구항 {n}의 {term}({num})은 선행 근거가 명확하지 않다.")
+            lines.append(f"(2) 청구항 {n}은 특허법 제42조제4항제2호에 위배된다.")
+    lines += [
+        "- 보정서 제출시 참고사항 -",
+        "보정 시 위 거절이유를 모두 고려하시기 바랍니다.",
+        "[첨 부]",
+        "첨부1 독일공개특허공보 DE102015000001 1부. 끝.",
+        "2025.11.10",
+        "특허청 심사관 홍길동",
+        "<< 안내 >>",
+        "명세서 또는 도면 등의 보정서를 전자문서로 제출할 경우 특허로에 접속하여 작성하시기 바랍니다.",
+        "QR 코드",
+    ]
+    return "\n".join(lines)
+
+def synthetic_ae(paragraphs: int) -> list:
+    lines = ["METHOD OF PRODUCING A MULTILAYER FILTER MEDIUM"]
+    for n in range(1, paragraphs + 1):
+        term, other = _EN_TERMS[n % len(_EN_TERMS)], _EN_TERMS[(n + 1) % len(_EN_TERMS)]
+        lines.append(f"[{n:04d}] The {term} {_TERMS[n % len(_TERMS)][1]} is bonded to the {other} "
+                     f"{_TERMS[(n + 1) % len(_TERMS)][1]} as shown in FIG. {n % 5 + 1}.")
+    return lines
+
+def docx_bytes(text: str) -> bytes:
+    doc = Document()
+    for line in text.splitlines():
+        doc.add_paragraph(line)
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+def minimal_pdf(lines: list, lines_per_page: int = 50) -> bytes:
+    # 외부 라이브러리 없이 Helvetica 텍스트만 담은 PDF를 직접 작성 (read_pdf의 텍스트 추출 경로 측정용)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in pages:
+        text = "".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T* " for line in page)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text}ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{off:010d} 00000 n \n" for off in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+# --- 측정 ---
+@contextmanager
+def measure(stages: dict, name: str):
+    # 단계 소요 시간과 단계 중 늘어난 최대 메모리(KB)
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield
+    stages[name] = {
+        "s": round(time.perf_counter() - start, 4),
+        "peak_kb": round((tracemalloc.get_traced_memory()[1] - before) / 1024, 1),
+    }
+
+def run_translation(jobs: dict, workers: int, args) -> tuple:
+    stub = StubClient(latency=args.latency, chunk_chars=args.chunk_chars, chunk_delay=args.chunk_delay, jitter=args.jitter,
+                      rate_limit_every=args.rate_limit_every, retry_after=args.retry_after, seed=args.seed)
+    client = RequestScheduler(stub, rpm=args.rpm, max_retries=args.max_retries, base_delay=args.retry_after)
+    telemetry = Telemetry("bench")
+
+    def run_block(job) -> str:
+        block, ae_context, hint, label = job
+        return translate_cached(None, client, args.model, ae_context, hint, block, telemetry=telemetry, label=label)
+
+    start = time.perf_counter()
+    results, errors = {}, 0
+    for i, translation, err in translate_all(run_block, jobs, workers):
+        if err is None:
+            results[i] = translation
+        else:
+            errors += 1
+    summary, sched = telemetry.summary(), client.snapshot()
+    return results, {
+        "workers": workers,
+        "wall_s": round(time.perf_counter() - start, 4),
+        "api_calls": stub.calls,
+        "requests": sched["requests"],
+        "retries": sched["retries"],
+        "rate_limited": sched["rate_limited"],
+        "errors": errors,
+        "prompt_tokens": summary["prompt_tokens"],
+        "completion_tokens": summary["completion_tokens"],
+        "avg_latency_s": summary["avg_latency_s"],
+        "avg_ttft_s": summary["avg_ttft_s"],
+        "avg_queue_s": summary["avg_queue_s"],
+    }
+
+def run_size(paragraphs: int, args) -> dict:
+    bk_data = docx_bytes(synthetic_bk(paragraphs))
+    ae_data = minimal_pdf(synthetic_ae(paragraphs * 3))
+    stages = {}
+    with measure(stages, "parse_bk"):
+        raw_bk = read_docx(io.BytesIO(bk_data))
+    with measure(stages, "parse_ae"):
+        ae_text = read_pdf(io.BytesIO(ae_data))
+    with measure(stages, "preclean"):
+        bk_text = preclean_bk(raw_bk)
+    with measure(stages, "split"):
+        numbered = split_into_numbered_blocks(bk_text)
+        header = extract_header_fields(raw_bk, ae_text)
+        split_blocks, header_hint = prepare_blocks(pretranslate_bk(bk_text), header)
+    with measure(stages, "pack"):
+        blocks = split_blocks if args.no_pack else pack_blocks(split_blocks, args.max_input_tokens, args.max_output_tokens)
+    with measure(stages, "term_index"):
+        term_index = TermIndex(ae_text)
+    with measure(stages, "term_context"):
+        header_block_idx = header_block_index(blocks, header_hint)
+        jobs = {
+            i: (b["src"], term_index.context_for(b["src"], args.term_budget), header_hint if i == header_block_idx else "", f"블록 {i + 1}")
+            for i, b in enumerate(blocks) if b["fixed"] is None
+        }
+
+    local_s = sum(stage["s"] for stage in stages.values())
+    fixed = {i: b["fixed"] for i, b in enumerate(blocks) if b["fixed"] is not None}
+    runs, results = [], fixed
+    for workers in args.concurrency:
+        translated, run = run_translation(jobs, workers, args)
+        results = {**fixed, **translated}
+        runs.append(run)
+    with measure(stages, "docx_export"):
+        builder = DocxBuilder()
+        builder.sync(results)
+        docx_size = len(builder.to_bytes())
+    local_s += stages["docx_export"]["s"]
+    for run in runs:
+        run["e2e_s"] = round(local_s + run["wall_s"], 4)  # 로컬 단계 + 번역 (모델 지연은 StubClient 설정값으로 모사)
+
+    packing = packing_report(split_blocks, blocks)
+    return {
+        "paragraphs": paragraphs,
+        "bk_bytes": len(bk_data),
+        "ae_bytes": len(ae_data),
+        "bk_chars": len(raw_bk),
+        "ae_chars": len(ae_text),
+        "numbered_blocks": len(numbered),
+        "blocks": len(blocks),
+        "local_blocks": len(fixed),
+        "planned_calls": packing["calls_after"],
+        "unpacked_calls": packing["calls_before"],
+        "docx_bytes": docx_size,
+        "local_s": round(local_s, 4),
+        "stages": stages,
+        "translation": runs,
+    }
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    # 같은 크기의 이전 결과보다 단계가 (tolerance 비율 + 5ms) 이상 느려졌거나 호출 수가 늘어난 항목
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["paragraphs"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        base = baseline.get(r["paragraphs"])
+        if base is None:
+            continue
+        for name, stage in r["stages"].items():
+            before = base["stages"].get(name, {}).get("s")
+            if before is not None and stage["s"] > before * (1 + tolerance) + 0.005:
+                regressions.append(f"{r['paragraphs']}단락 {name}: {before}s → {stage['s']}s")
+        if r["planned_calls"] > base["planned_calls"]:
+            regressions.append(f"{r['paragraphs']}단락 API 호출: {base['planned_calls']} → {r['planned_calls']}회")
+    return regressions
+
+def parse_args(argv=None):
+    int_list = lambda value: [int(v) for v in value.split(",") if v.strip()]
+    p = argparse.ArgumentParser(description="합성 OA 문서로 번역 파이프라인의 단계별 시간·메모리·호출 수를 오프라인 측정합니다.")
+    p.add_argument("-o", "--output", default="bench_results.json", help="결과 JSON 경로")
+    p.add_argument("--sizes", type=int_list, default=[10, 40, 160], help="문서별 번호 단락 수 (쉼표 구분)")
+    p.add_argument("--concurrency", type=int_list, default=[1, 4, 8], help="비교할 동시 요청 수 (쉼표 구분)")
+    p.add_argument("--model", default="gpt-4o")
+    p.add_argument("--latency", type=float, default=0.2, help="대역 모델의 첫 토큰 지연(초)")
+    p.add_argument("--jitter", type=float, default=0.2, help="지연의 ±비율")
+    p.add_argument("--chunk-chars", type=int, default=40, help="스트리밍 조각 크기(글자)")
+    p.add_argument("--chunk-delay", type=float, default=0.002, help="스트리밍 조각 사이 지연(초)")
+    p.add_argument("--rate-limit-every", type=int, default=0, help="n번째 호출마다 429 발생 (0=없음)")
+    p.add_argument("--retry-after", type=float, default=0.05, help="429 응답의 Retry-After(초), 재시도 기본 지연")
+    p.add_argument("--max-retries", type=int, default=4)
+    p.add_argument("--rpm", type=int, default=100_000, help="스케줄러 분당 최대 요청 수")
+    p.add_argument("--term-budget", type=int, default=600, help="블록당 A_E 용어 컨텍스트 토큰 예산")
+    p.add_argument("--max-input-tokens", type=int, default=MAX_INPUT_TOKENS)
+    p.add_argument("--max-output-tokens", type=int, default=MAX_OUTPUT_TOKENS)
+    p.add_argument("--no-pack", action="store_true", help="번호 단락을 묶지 않고 하나씩 요청")
+    p.add_argument("--seed", type=int, default=0, help="지연 지터 난수 시드")
+    p.add_argument("--baseline", help="비교할 이전 결과 JSON (회귀 시 종료 코드 1)")
+    p.add_argument("--tolerance", type=float, default=0.25, help="단계 시간 회귀 판정 허용 비율")
+    return p.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    tracemalloc.start()
+    results = []
+    for paragraphs in args.sizes:
+        result = run_size(paragraphs, args)
+        results.append(result)
+        e2e = " · ".join(f"w{run['workers']} {run['e2e_s']}s" for run in result["translation"])
+        print(f"{paragraphs:>5}단락: 블록 {result['blocks']} · 호출 {result['planned_calls']}회 (묶기 전 {result['unpacked_calls']}회)"
+              f" · 로컬 {result['local_s']}s · 전체 {e2e}")
+    tracemalloc.stop()
+
+    report = {
+        "meta": {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "instruction_hash": INSTRUCTION_HASH,
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"결과: {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"[회귀] {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
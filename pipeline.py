@@ -0,0 +1,1438 @@
+import re
+import io
+import csv
+import json
+import math
+import time
+import sqlite3
+import random
+import base64
+import difflib
+import hashlib
+import functools
+import threading
+from collections import Counter, defaultdict, deque
+from types import SimpleNamespace
+from datetime import datetime
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai
+from pypdf import PdfReader
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.oxml.ns import qn
+from docx.shared import Inches
+from PIL import Image
+
+# =========================================================================
+# 지침 v2.1 원문 100% 그대로 삽입 (변경/요약 절대 금지 준수)
+# =========================================================================
+MY_INSTRUCTION = r"""
+### 특허 OA 전문 번역 시스템 최종 통합 지침 (v2.1 - 누락 방지 완결본)
+
+당신은 거예통지서를 영문으로 번역하는  **'기계적 번역 엔진(Mechanical Translation Engine)'**이다. 문학적 윤색, 의역, 문장 다듬기는 **'치명적인 시스템 오류'**로 간주한다. 문장이 투박하고 어색하더라도 국문 원문의 구조와 단어를 **[지침]**에 근거해 기계적으로 1:1 치환(Compiling)하는 것이 유일한 목표다.
+
+**[1. 작업 자동화 및 파일 인식 규칙]**
+
+- **A_E 포함 파일 (예: OABASE0004_A_E):** 기준이 되는 **[영문 명세서]**. 모든 기술 용어 선택의 절대적 기준으로 삼습니다.
+- **B_K 포함 파일 (예: OABASE0004_B_K):** 번역 대상인 **[국문 거절이유통지서]**. 작업을 시작하는 대상입니다.
+- **최종 결과물 명명:** `OABASE[번호]_C_E.docx` 형식으로 워드 파일을 생성하여 제공합니다.
+
+**[2. 헤더 유닛 및 서식 (전체 좌측 정렬)]**
+모든 항목은 좌측 정렬하며, 항목명과 데이터 사이에는 **[Tab]**을 사용하여 시작 위치를 세로로 일정하게 정렬하십시오.
+
+- **[English Translation]** (최상단)
+- **NOTICE OF PRELIMINARY REJECTION** (중앙 정렬, 대문자 굵게)
+- **Mailing Date:** `[Tab]` [B_K 발송일자: Month DD, YYYY 형식]
+- **Response Due Date:** `[Tab]` [B_K 제출기일: Month DD, YYYY 형식]
+- **Applicant:** `[Tab]` [B_K 출원인 명칭: 영문 대문자]
+- **Attorney:** `[Tab]` **Hoon Chang** (고정값)
+- **Application No.:** `[Tab]` [B_K 출원번호: 10-YYYY-XXXXXXX 형식]
+- **Title of Invention:** `[Tab]` [**A_E 명세서의 발명 명칭**을 토씨 하나 틀리지 않게 그대로 가져와 영문 대문자 굵게 표기]
+
+## [3. 단락 제목 고정 매핑 (Literal Mapping)]
+
+아래의 국문 단락 제목은 의미 해석 없이 "문자열 매칭 → 고정 영문 치환" 방식으로만 처리한다.
+
+- **심사결과** → **EXAMINATION RESULTS** (대문자, Bold)
+- **구체적인 거절이유** → **DETAILED REASONS** (대문자, Bold)
+- **인용발명** → **Reference** (Title Case, Bold)
+- **보정서 제출시 참고사항** → **Notes for Amendment** (Title Case, Bold)
+- **[첨부]** → **Attachments:** (Title Case, 콜론 포함, Bold)
+- 인용발명을 쓸 때 아래와 같은 형식으로 번역을 하도록 하되 **특허 공보 번호 데이터 누락을 하지 않도록 한다.** **Reference 2:    Korean Patent Application Publication No. 10-2019-0019667(February 27, 2019)**
+
+### [4. 상단 고정 표준 문구 (Introductory Text - Forced Mapping)]
+
+**1. 강제 치환 원칙 (Forced Replacement)**
+아래의 [국문 패턴]이 탐지되면 이를 번역하지 마십시오. 해당 단락 전체를 무시하고 지정된 **[영문 고정 문구]**로 1:1 치환하여 출력합니다. 국문 내의 특정 날짜나 서식 번호가 다르더라도 무조건 아래 문구를 출력합니다.
+
+**2. 고정 매핑 데이터**
+
+- **[국문 패턴 1]:** "이 출원에 대한 심사결과... 통지 하오니... 제출하여 주시기 바랍니다."
+    - **[영문 고정 문구 1]:** "According to Article 63 of the Korean Patent Act (KPA), this is to notify the applicant of a preliminary rejection as a result of examination of the present application. The applicant may submit an Argument and/or Amendment by the above response due date."
+- **[국문 패턴 2]:** "상기 제출기일... 연장하려는 경우에는... 연장신청을 해야 합니다."
+    - **[영문 고정 문구 2]:** "The due date can be extended, in principle, for up to four months. The applicant may apply for an extension for one month, or, if necessary, for two or more months at a time. When applying for a time extension in excess of four months based on unavoidable circumstances (see the Guidelines for Time Extensions given below), the applicant is required to submit a justification statement to the Examiner."
+
+**3. 배치 순서 (Placement Order)**
+위 두 영문 문단은 **[2. 헤더 유닛]** 바로 다음에 위치해야 하며, 본문(EXAMINATION RESULTS)이 시작되기 전에 반드시 순서대로 삽입하십시오.
+
+**[5. 본문 구조 및 이미지 처리 (Section Framework & Visuals)]**
+
+- **EXAMINATION RESULTS (대문자 굵게):**
+    - `Claims under Examination: Claims X to Y` 형식 유지.
+    - `Rejected Parts and Relevant Provisions:` 아래에 번호, 거절항목, 관련법조항이 포함된 표(Table)를 생성할 것.
+- **DETAILED REASONS (대문자 굵게):**
+    - 국문 원본(B_K)의 번호 체계(`1.`, `①`, `[ ]`) 및 **굵은 글씨(Bold)** 위치를 완벽히 재현할 것.
+- **이미지 삽입:** **국문 통지서(B_K)의 표 내부나 본문에 도면(이미지)이 있는 경우, 해당 도면을 캡처하듯 그대로 가져와 영문 번역본의 동일한 위치에 삽입하십시오.**
+
+**[5. 기술 용어 및 법률 표준 문구 (Strict Mapping)]**
+
+- **명세서 용어 100% 일치:** 모든 기술 용어(부품명, 가공 방식 등)는 반드시 A_E 명세서의 용어를 찾아 매칭하며, 임의 번역이나 동의어 치환을 절대 금지합니다.
+- **인용 문헌 표기:** 인용 발명(Prior Art)은 국가명(German, Korean, US 등)과 공보의 종류를 포함한 **풀네임(Full Name)**을 기재하십시오. (예: German Patent Publication DE...)
+- **표준 법률 표현:**
+    - '통상의 기술자' → **A person having ordinary skill in the art**
+    - '수행주체' → **"the subject (hardware) that performs"**, '선행 근거' → **"antecedent basis"**
+    - 법조항: **Article [번호] of the KPA** 형식 고수.
+- **참조 기호:** 도면 부호 및 단락 번호 인용 방식을 A_E와 동일하게 유지합니다.
+
+### [6. <<안내>> 고정 표준 문구 및 종결 처리 규칙]
+
+**1. 실행 시점 (Execution Timing)**
+
+- 본문(EXAMINATION RESULTS, DETAILED REASONS, 보정서 제출 시 참고사항 등)의 **모든 번역이 완료된 직후**에 이 규칙을 적용합니다.
+- 국문 원문에서 `<< 안내 >>` 또는 이와 유사한 시각적 구분선(안내 박스)이 나타나는 지점을 **'치환 시작점'**으로 인식하십시오.
+
+**2. 강제 치환 및 문서 종결 (Forced Replacement & Termination)**
+
+- `<< 안내 >>` 문구부터 문서의 최하단(QR 코드 및 주소 포함)까지의 모든 내용은 번역하지 않습니다.
+- 해당 영역 전체를 삭제하고, 아래의 **[영문 고정 문구 블록]** 하나로 통째로 갈음하십시오.
+- **출력 직후 즉시 `End.`를 표기하여 문서가 완결되었음을 나타내십시오.**
+- **[위치 고정 규칙]**: **Attachments(첨부)** 항목은 반드시 본문의 모든 내용이 출력된 후, **날짜(Mailing Date)와 발행기관/심사관 서명란 바로 위**에 위치해야 합니다.
+- 본문 번역 도중 `Attachments:`가 뜬금없이 등장하는 것은 **'치명적인 시스템 오류'**로 간주합니다.
+
+**[영문 고정 문구 블록]**
+
+> Guidelines for Time Extensions
+According to the Guidelines for Time Extensions, the Examiner determines whether to approve a time extension and the length of the extension after determining if any of the following grounds apply:
+(1) Where the applicant newly appoints an agent or changes or discharges all of the previous agents within one (1) month prior to the expiry of the designated term;
+(2) Where the applicant submits a notice of change in the applicant within one (1) month prior to the expiry of the designated term; however, this may only be applied when a new applicant is added to an application.
+(3) Where the applicant receives an examination result from a foreign Patent Office within two (2) months prior to the expiry of the designated term and intends to reflect the examination result in an amendment (in this case, when submitting a request for an extension, the applicant should also submit copies of the examination result and the relevant claims);
+(4) Where the service of an Office Action was delayed for one or more months (eligible for an extra extension of one (1) month);
+(5) Where the parent application or a divisional application is pending in an IPTAB trial or a litigation;
+(6) Where more time is needed to conduct a test and measure the results thereof in connection with an Office Action; or
+(7) Where circumstances for which the applicant is not responsible necessitate an extension of the deadline.
+*However, where the examination of the application commenced according to a third party’s request, extensions under items (1) to (5) above will not be granted.
+> 
+> 
+> **Partial Refund on Examination Fee**
+> If the Applicant abandons or withdraws an application within the response period of a first Office Action, an amount equivalent to 1/3 of the official fees for requesting an examination shall be refunded at the Applicant’s request.
+> 
+
+**3. 연속성 보장 규칙 (Continuity Assurance)**
+
+- **절대 금지:** `<< 안내 >>` 섹션을 만났다고 해서 앞선 본문 번역을 생략하거나 요약하는 행위.
+- 반드시 본문의 마지막 섹션(예: [첨부] 또는 심사관 성명 라인)까지 출력을 완료한 후, 그 바로 다음 줄에 위 고정 문구를 붙여넣으십시오.
+
+**[7. 번역의 기본 원칙 (Literal Translation & Completeness)]** 지침에서 달리 지정한 고정 문구를 제외하고는 다음과 같은 번역 기본원칙을 준수한다.
+
+- **직역(Literal Translation) 절대 원칙:** 번역은 문학적 윤색을 배제하고 단어 및 문장 구조를 1:1로 대응시키는 직역을 원칙으로 하며, 원문에 문법적 오류나 비문이 있더라도 이를 수정하지 않고 그대로 번역한다.
+- **[절대 금지]:** 의역, 요약, 생략, 중략, 임의 추가는 전면 금지되며, 원문에 없는 내용이나 접속사(그래서, 하지만 등)를 추가해서도 안 된다.
+- **용어 고정 매핑:** 명세서 전체에 걸쳐 동일한 국문 용어는 반드시 동일한 영문 용어로 고정 매핑하여 사용한다.
+
+**[8. 번역 출력 원칙 (Batch Output)]** 출력할 때 요약을 하거나 핵심만을 보여줘서는 안 된다.
+
+**[출력 분할 규칙 – Hard Limit + Number-Aware Cut]**
+
+- 출력은 **절대적으로 최대 2쪽 분량을 초과해서는 안 된다.** 내가 '다음'이라고 하면 그다음 분량을 번역해. 절대로 요약하지 말고 한 단어도 빠짐없이 직역해.
+- 분할은 **번호 단락(1., 2., 3., (1), (2), (3) …)의 경계에서만 수행한다.**
+- **2쪽 이내에서 번호 단락이 완결되는 지점이 존재하는 경우, 그 지점에서 분할한다.**
+- **2쪽 이내에 번호 단락의 완결 지점이 존재하지 않는 경우, 해당 번호 단락은 다음 출력 분량으로 이월하고, 현재 분량은 그 직전 번호 단락까지 출력한다.**
+
+**[종결 블록 처리]**
+
+- [보정서 제출시 참고사항]이 원문에 존재하는 경우, 누락하지 말고 전체를 번역·출력한다.
+원문에 [보정서 제출시 참고사항]이 존재하는 경우, 해당 블록이 출력되기 전에는 [첨부], 날짜/서명, <<안내>>, “End.”를 출력하지 않는다.
+- **Attachments / Mailing Date / <<안내>>의 순서도 원문 배열을 1:1로 유지**
+- 섹션 재분류, 재배치, 구조적 “정리”는 하지 않음
+
+**[섹션 포함 및 문서 종료 규칙]**
+
+- **[보정서 제출시 참고사항]은 본문에 포함되는 섹션이므로, 누락하지 말고 전체를 번역·출력한다.**
+- 문서는 **[첨부] → 날짜 → 발행기관/심사관(서명 라인) → << 안내 >>** 순서까지 **모두 출력된 경우에만** 종료된 것으로 판단한다.
+- 위 종결부 블록은 **순서를 변경하거나 분할하지 않는다.**
+
+**[번역 제외 대상]** - 지침 내용: 본 문서의 번역 시, 아래에 해당하는 내용은  번역하지 않으며, 최종 번역본에서 완전히 무시하고 누락(Omit) 시키도록 합니다.
+- 번역 제외 대상 예시:
+    - 수신: 서울특별시 종로구 세종대로 149, 14층 (세종로, 광화문빌딩)(법무법인센트럴)장훈 귀하(귀중) 03186
+- 번역시, 페이지 번호에 해당하는 것은 번역하지 않고 생략하도록 한다.
+
+# [5. 표 및 이미지의 기계적 치환 규칙] 업데이트
+
+[5. 표 및 이미지의 기계적 치환 규칙]
+
+1. 표(Table) 처리:
+- 원문에 표(Table)가 등장할 경우, 내부 내용을 번역하거나 구조를 재현하지 마십시오.
+- 표가 있던 정확한 위치에 <###TABLE>이라는 문자열만 단독 행으로 표기하고 다음 문장으로 넘어갑니다.
+
+2. 이미지/도면(Figure/Image) 처리:
+- 원문에 도면, 그래프, 사진 등 모든 종류의 이미지가 등장할 경우, 이를 설명하거나 무시하지 마십시오.
+- 이미지가 있던 정확한 위치에 <###FIGURE>라는 문자열만 단독 행으로 표기합니다.
+"""
+
+# 지침 버전: 지침 문구가 바뀌면 해시가 달라져 이전 번역 캐시는 자동으로 무효가 됨
+INSTRUCTION_VERSION = "v2.1"
+INSTRUCTION_HASH = hashlib.sha256((INSTRUCTION_VERSION + MY_INSTRUCTION).encode("utf-8")).hexdigest()[:16]
+TEMPERATURE = 0
+
+# =========================================================================
+# 번역 파이프라인 (Streamlit 앱 app.py와 일괄 처리 CLI batch.py 공용)
+# =========================================================================
+
+# --- 텔레메트리: 모델 호출·처리 단계별 지연과 토큰 사용량 기록 ---
+class Telemetry:
+    # 문서 하나당 하나. 이벤트는 메모리에 쌓고, log_path를 주면 JSONL로도 한 줄씩 추가 기록 (용량 계획용 누적 로그)
+    FIELDS = ["ts", "document", "kind", "name", "block", "model", "latency_s", "ttft_s", "queue_s",
+              "prompt_tokens", "completion_tokens", "cached_tokens", "retries", "status", "detail"]
+    _log_lock = threading.Lock()  # 여러 문서가 같은 JSONL 파일에 쓰는 경우 대비
+
+    def __init__(self, document: str = "", log_path: str = None):
+        self.document = document
+        self.log_path = log_path
+        self.events = []
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, name: str, **fields) -> dict:
+        event = dict.fromkeys(self.FIELDS)
+        event.update(ts=datetime.now().isoformat(timespec="milliseconds"), document=self.document, kind=kind, name=name)
+        event.update(fields)
+        with self.lock:
+            self.events.append(event)
+        if self.log_path:
+            with Telemetry._log_lock, open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        return event
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        # with telemetry.stage("docx_export"): ... 형태로 새 단계를 같은 방식으로 계측
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.record("stage", name, latency_s=round(time.perf_counter() - start, 4), status=status, **fields)
+
+    def timed(self, name: str):
+        # @telemetry.timed("stage") 데코레이터 형태
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self, pricing: dict = None) -> dict:
+        with self.lock:
+            events = list(self.events)
+        calls = [e for e in events if e["kind"] == "call"]
+        latencies = [e["latency_s"] for e in calls if e["latency_s"] is not None]
+        ttfts = [e["ttft_s"] for e in calls if e["ttft_s"] is not None]
+        queues = [e["queue_s"] for e in calls if e["queue_s"] is not None]
+        stages = defaultdict(float)
+        for e in events:
+            if e["kind"] == "stage":
+                stages[e["name"]] += e["latency_s"] or 0.0
+        return {
+            "calls": len(calls),
+            "errors": sum(1 for e in calls if e["status"] not in ("ok", None)),
+            "retries": sum(e["retries"] or 0 for e in calls),
+            "prompt_tokens": sum(e["prompt_tokens"] or 0 for e in calls),
+            "completion_tokens": sum(e["completion_tokens"] or 0 for e in calls),
+            "cached_tokens": sum(e["cached_tokens"] or 0 for e in calls),
+            "latency_s": round(sum(latencies), 3),
+            "avg_latency_s": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "max_latency_s": max(latencies) if latencies else None,
+            "avg_ttft_s": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+            "avg_queue_s": round(sum(queues) / len(queues), 3) if queues else None,
+            "cost_usd": round(sum(
+                estimate_cost(e["model"], e["prompt_tokens"] or 0, e["completion_tokens"] or 0, pricing) for e in calls
+            ), 4),
+            "stages": {name: round(sec, 3) for name, sec in stages.items()},
+        }
+
+    def to_jsonl(self) -> str:
+        with self.lock:
+            return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self.events)
+
+    def to_csv(self) -> str:
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=self.FIELDS)
+        writer.writeheader()
+        with self.lock:
+            writer.writerows(self.events)
+        return buf.getvalue()
+
+def read_docx(file) -> str:
+    doc = Document(file)
+    return "\n".join([p.text for p in doc.paragraphs]).strip()
+
+def read_pdf(file) -> str:
+    reader = PdfReader(file)
+    return "\n".join([page.extract_text() or "" for page in reader.pages]).strip()
+
+def preclean_bk(text: str) -> str:
+    text = re.sub(r"수신\s*:.*?(?:귀하|귀중).*", "", text, flags=re.DOTALL)
+    text = re.sub(r"\d+\s*/\s*\d+", "", text)
+    text = re.sub(r"\d{2}-\d{4}-\d{7}", "", text)
+    text = re.sub(r"(?m)^\d{9,10}$", "", text)
+    return text.strip()
+
+NUMBERED_PAT = re.compile(r"(?m)^(?:\s*(\d+\.)\s+|\s*(\(\d+\))\s+|\s*([①-⑩])\s+|\s*(\[첨\s*부\])\s*|(- 보정서 제출시 참고사항 -))")
+
+def split_into_numbered_blocks(text: str) -> list:
+    idxs = [m.start() for m in NUMBERED_PAT.finditer(text)]
+    if not idxs: return [text]
+    idxs.append(len(text))
+    return [text[idxs[i]:idxs[i+1]].strip() for i in range(len(idxs)-1)]
+
+# --- 고정 매핑 구간 로컬 사전 번역 (LLM 미전송) ---
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _ENCODING = None
+
+def count_tokens(text: str) -> int:
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # tiktoken이 없을 때의 근사치: 영문 약 4자/토큰, 한글 약 1자/토큰
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+def _fixed_phrase(n: int) -> str:
+    return re.search(rf'\[영문 고정 문구 {n}\]:\*\* "(.*?)"', MY_INSTRUCTION).group(1)
+
+def _fixed_guidelines() -> str:
+    body = MY_INSTRUCTION.split("**[영문 고정 문구 블록]**")[-1].split("**3. 연속성 보장 규칙", 1)[0]
+    lines = [re.sub(r"^>\s?", "", line).rstrip() for line in body.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+FIXED_INTRO_1 = _fixed_phrase(1)
+FIXED_INTRO_2 = _fixed_phrase(2)
+FIXED_GUIDELINES = _fixed_guidelines() + "\n\nEnd."
+
+# 지침 [3. 단락 제목 고정 매핑]: 단독 행으로 나타나는 제목만 치환
+HEADING_MAP = [
+    (r"심사\s*결과", "**EXAMINATION RESULTS**"),
+    (r"구체적인\s*거절\s*이유", "**DETAILED REASONS**"),
+    (r"인용\s*발명", "**Reference**"),
+    (r"보정서\s*제출\s*시\s*참고\s*사항", "**Notes for Amendment**"),
+    (r"첨\s*부", "**Attachments:**"),
+]
+_HEADING_DECOR = r"[\s\-<>\[\]【】〔〕《》:]*"
+
+INTRO_1_PAT = re.compile(r"이\s*출원에\s*대한\s*심사\s*결과.{0,600}?제출하여\s*주시기\s*바랍니다\.?", re.DOTALL)
+INTRO_2_PAT = re.compile(r"상기\s*제출\s*기일.{0,600}?연장\s*신청을\s*해야\s*합니다\.?", re.DOTALL)
+GUIDANCE_PAT = re.compile(r"<<\s*안\s*내\s*>>|《\s*안\s*내\s*》")
+
+def build_header_unit(mail_date: str, due_date: str, applicant: str, app_no: str, title_inv: str) -> str:
+    return "\n".join([
+        "[English Translation]",
+        "**NOTICE OF PRELIMINARY REJECTION**",
+        f"Mailing Date:\t{mail_date}",
+        f"Response Due Date:\t{due_date}",
+        f"Applicant:\t{applicant.upper()}",
+        "Attorney:\t**Hoon Chang**",
+        f"Application No.:\t{app_no}",
+        f"Title of Invention:\t**{title_inv.upper()}**",
+    ])
+
+def _fixed_spans(text: str) -> list:
+    # (시작, 끝, 종류, 고정 영문) 목록. 종류 "header"의 영문은 헤더 입력값으로 나중에 채움
+    spans = []
+    m1 = INTRO_1_PAT.search(text)
+    if m1:
+        # 도입 문구 앞은 국문 헤더 영역이므로 로컬 헤더 유닛으로 대체
+        if m1.start() > 0:
+            spans.append((0, m1.start(), "header", None))
+        spans.append((m1.start(), m1.end(), "intro", FIXED_INTRO_1))
+    m2 = INTRO_2_PAT.search(text, m1.end() if m1 else 0)
+    if m2:
+        spans.append((m2.start(), m2.end(), "intro", FIXED_INTRO_2))
+    guide = GUIDANCE_PAT.search(text)
+    if guide:
+        spans.append((guide.start(), len(text), "guidelines", FIXED_GUIDELINES))
+    for pat, english in HEADING_MAP:
+        for m in re.finditer(rf"(?m)^{_HEADING_DECOR}{pat}{_HEADING_DECOR}$", text):
+            spans.append((m.start(), m.end(), "heading", english))
+    # 겹치는 구간은 앞선(더 넓은) 구간을 우선
+    spans.sort(key=lambda sp: (sp[0], -sp[1]))
+    merged, last_end = [], 0
+    for sp in spans:
+        if sp[0] >= last_end:
+            merged.append(sp)
+            last_end = sp[1]
+    return merged
+
+def pretranslate_bk(text: str) -> list:
+    # preclean_bk 결과를 블록 목록으로 변환: {"src": 국문, "fixed": 고정 영문 또는 None, "kind": 종류}
+    blocks, pos = [], 0
+
+    def add_src(chunk: str):
+        chunk = chunk.strip()
+        if not chunk:
+            return
+        # 첫 번호 표식 앞의 도입 문장(제목 바로 뒤 안내 문장 등)은 split_into_numbered_blocks가 버리므로 별도 블록으로 보존
+        first = NUMBERED_PAT.search(chunk)
+        if first and chunk[:first.start()].strip():
+            blocks.append({"src": chunk[:first.start()].strip(), "fixed": None, "kind": None})
+            chunk = chunk[first.start():]
+        blocks.extend({"src": b, "fixed": None, "kind": None} for b in split_into_numbered_blocks(chunk))
+
+    for start, end, kind, english in _fixed_spans(text):
+        add_src(text[pos:start])
+        if text[start:end].strip():
+            blocks.append({"src": text[start:end].strip(), "fixed": english, "kind": kind})
+        pos = end
+    add_src(text[pos:])
+    return blocks or [{"src": text, "fixed": None, "kind": None}]
+
+def prepare_blocks(base_blocks: list, header: dict) -> tuple:
+    # pretranslate_bk 결과에 헤더 값(extract_header_fields 형식)을 반영. 반환: (단락 블록 목록, 헤더 힌트)
+    # 국문 헤더 영역이 있으면 로컬 헤더 유닛으로 채우고 힌트는 "". 없을 때만 첫 번역 블록에 보낼 헤더 힌트를 만듦
+    # (나머지 블록은 문서와 무관하게 캐시 재사용 가능)
+    header_unit = build_header_unit(header["mail_date"], header["due_date"], header["applicant"], header["app_no"], header["title_inv"])
+    split_blocks = [dict(b, fixed=header_unit) if b["kind"] == "header" else b for b in base_blocks]
+    if any(b["kind"] == "header" for b in split_blocks):
+        return split_blocks, ""
+    return split_blocks, (f"Mailing Date: {header['mail_date']}\nDue Date: {header['due_date']}\nApplicant: {header['applicant']}"
+                          f"\nApp No: {header['app_no']}\nTitle: {header['title_inv']}")
+
+def header_block_index(blocks: list, header_hint: str):
+    # 헤더 힌트를 함께 보낼 블록 번호 (첫 번역 대상 블록). 힌트가 없으면 None
+    return next((i for i, b in enumerate(blocks) if b["fixed"] is None), None) if header_hint else None
+
+# --- A_E 명세서 용어 색인 (BM25 + 도면 부호 용어집) ---
+_STOPWORDS = {
+    "the", "a", "an", "of", "and", "or", "to", "in", "on", "at", "by", "for", "with", "from", "as", "is", "are",
+    "be", "been", "this", "that", "these", "those", "said", "which", "wherein", "such", "its", "it", "each",
+    "may", "can", "further", "first", "second", "fig", "figs", "figure", "according", "embodiment", "example",
+}
+# 용어집 추출 시 이 단어들 중 마지막 것 뒤의 명사구만 용어로 사용 (동사·전치사)
+_LEAD_SKIP = _STOPWORDS | {
+    "shows", "show", "shown", "has", "have", "having", "comprises", "comprising", "includes", "including",
+    "provided", "arranged", "formed", "between", "into", "onto", "via", "through", "when", "where", "also", "both",
+    "connects", "connected", "connecting", "bonds", "bonded", "attached", "attaches", "coupled", "couples",
+    "disposed", "mounted", "contains", "containing", "defines", "defining", "surrounds", "surrounding",
+    "receives", "receiving", "extends", "extending", "covers", "covering", "faces", "facing", "then", "not",
+}
+_TOKEN_PAT = re.compile(r"[A-Za-z][A-Za-z\-]+|\d+[a-z']?")
+# "filter layer 12", "the support layers (14)" 형태의 (용어, 부호) 쌍
+_NUMERAL_TERM_PAT = re.compile(r"\b((?:[A-Za-z][A-Za-z\-]*\s+){0,3}[A-Za-z][A-Za-z\-]*)\s+\(?(\d{1,4}[a-z']?)\)?(?!\w)(?!\.\d)")
+# 국문 블록의 도면 부호: "필터층(12)" (괄호 없는 "청구항1", "도면3", "표1" 등은 부호가 아님)
+_KO_NUMERAL_PAT = re.compile(r"[가-힣]\s?\(\s*(\d{1,4}[a-z']?)\s*\)")
+_PARA_REF_PAT = re.compile(r"\[\s*(\d{4})\s*\]")
+
+def _index_tokens(text: str) -> list:
+    return [t for t in (w.lower() for w in _TOKEN_PAT.findall(text)) if t not in _STOPWORDS]
+
+def split_spec_paragraphs(text: str) -> list:
+    # 단락 번호 [0001]이 있으면 그 경계로, 없으면 빈 줄, 그것도 없으면 약 800자 단위로 분할
+    if len(_PARA_REF_PAT.findall(text)) >= 3:
+        idxs = [m.start() for m in _PARA_REF_PAT.finditer(text)] + [len(text)]
+        paras = [text[idxs[i]:idxs[i+1]] for i in range(len(idxs)-1)]
+        if idxs[0] > 0:
+            paras.insert(0, text[:idxs[0]])
+    elif re.search(r"\n\s*\n", text):
+        paras = re.split(r"\n\s*\n", text)
+    else:
+        paras, buf = [], ""
+        for line in text.splitlines():
+            buf += line + "\n"
+            if len(buf) >= 800:
+                paras.append(buf)
+                buf = ""
+        paras.append(buf)
+    return [re.sub(r"\s+", " ", p).strip() for p in paras if p.strip()]
+
+class TermIndex:
+    # 업로드된 A_E 파일당 한 번 생성. 블록마다 관련 단락과 용어집 항목만 골라 토큰 예산 안에서 반환
+    def __init__(self, ae_text: str, k1: float = 1.5, b: float = 0.75):
+        self.paragraphs = split_spec_paragraphs(ae_text)
+        self.k1, self.b = k1, b
+        self.para_ids = {}
+        self.postings = defaultdict(dict)
+        self.lengths = []
+        for pid, para in enumerate(self.paragraphs):
+            ref = _PARA_REF_PAT.match(para)
+            if ref:
+                self.para_ids.setdefault(ref.group(1), pid)
+            tokens = _index_tokens(para)
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term][pid] = tf
+        self.avg_len = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        self.glossary = self._build_glossary(ae_text)
+
+    @staticmethod
+    def _build_glossary(ae_text: str) -> dict:
+        # 부호별로 가장 자주 쓰인 용어 (마지막 불용어·동사 뒤의 명사구만: "connects the pleated structure 20" → "pleated structure")
+        # 부호는 A_E에 많이 나온 순서 (동률이면 처음 나온 순서)
+        counts = defaultdict(Counter)
+        for m in _NUMERAL_TERM_PAT.finditer(ae_text):
+            words = m.group(1).split()
+            words = words[max((i + 1 for i, w in enumerate(words) if w.lower() in _LEAD_SKIP), default=0):]
+            if words and words[-1].lower() not in _STOPWORDS and not re.fullmatch(r"(?i)figs?|claims?|step", words[-1]):
+                counts[m.group(2)][" ".join(words).lower()] += 1
+        ranked = sorted(counts.items(), key=lambda item: -sum(item[1].values()))
+        return {numeral: c.most_common(1)[0][0] for numeral, c in ranked}
+
+    def _bm25(self, terms: list) -> list:
+        n = len(self.paragraphs)
+        scores = defaultdict(float)
+        for term in dict.fromkeys(terms):  # set()은 해시 시드에 따라 순서가 바뀌어 점수 합산 순서·동점 순위가 달라짐
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for pid, tf in posting.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[pid] / (self.avg_len or 1))
+                scores[pid] += idf * tf * (self.k1 + 1) / norm
+        return sorted(scores, key=lambda pid: (-scores[pid], pid))
+
+    def context_for(self, block: str, budget_tokens: int) -> str:
+        numerals = _KO_NUMERAL_PAT.findall(block)
+        glossary_lines = [f"{num}: {self.glossary[num]}" for num in dict.fromkeys(numerals) if num in self.glossary]
+        # 블록에 직접 등장한 부호 외에는 자주 쓰인 부호 순으로 용어집을 채움
+        rest = [f"{num}: {term}" for num, term in self.glossary.items() if num not in numerals]
+        query = _index_tokens(block) + numerals
+        for num in numerals:
+            if num in self.glossary:
+                query += _index_tokens(self.glossary[num])
+        ranked = [self.para_ids[ref] for ref in _PARA_REF_PAT.findall(block) if ref in self.para_ids]
+        ranked += [pid for pid in self._bm25(query) if pid not in ranked]
+
+        used, glossary_out, para_out = 0, [], []
+        for line in glossary_lines:
+            cost = count_tokens(line)
+            if used + cost > budget_tokens:
+                break
+            glossary_out.append(line)
+            used += cost
+        for pid in ranked:
+            cost = count_tokens(self.paragraphs[pid])
+            if used + cost > budget_tokens:
+                continue
+            para_out.append(pid)
+            used += cost
+        for line in rest:
+            cost = count_tokens(line)
+            if used + cost > budget_tokens:
+                break
+            glossary_out.append(line)
+            used += cost
+
+        parts = []
+        if glossary_out:
+            parts.append("[도면 부호 용어집]\n" + "\n".join(glossary_out))
+        if para_out:
+            parts.append("[관련 명세서 단락]\n" + "\n".join(self.paragraphs[pid] for pid in sorted(para_out)))
+        return "\n\n".join(parts)
+
+def fixed_savings(blocks: list) -> dict:
+    # 로컬 처리로 LLM에 보내지 않은 원문 글자 수 / 입력·출력 토큰 추정치
+    fixed = [b for b in blocks if b["fixed"] is not None]
+    return {
+        "blocks": len(fixed),
+        "chars": sum(len(b["src"]) for b in fixed),
+        "tokens": sum(count_tokens(b["src"]) + count_tokens(b["fixed"]) for b in fixed),
+    }
+
+# --- 토큰 예산 기반 블록 묶기 (Number-Aware Cut) ---
+# 지침의 "최대 2쪽" 출력 한도를 토큰으로 환산한 기본값과, 국문 입력 대비 영문 출력 토큰 비율 추정치
+MAX_INPUT_TOKENS = 1200
+MAX_OUTPUT_TOKENS = 1600
+OUTPUT_RATIO = 1.3
+
+def pack_blocks(blocks: list, max_input_tokens: int = MAX_INPUT_TOKENS, max_output_tokens: int = MAX_OUTPUT_TOKENS,
+                output_ratio: float = OUTPUT_RATIO) -> list:
+    # 인접한 번역 대상 블록(번호 단락)을 예산 안에서 합침. 분할은 원래 번호 단락 경계에서만 일어나고,
+    # 고정 매핑 블록은 그대로 두어 묶음의 경계가 됨. 혼자서 예산을 넘는 블록은 "oversize"로 표시
+    budget = min(max_input_tokens, int(max_output_tokens / output_ratio))
+    packed, group, group_tokens = [], [], 0
+
+    def flush():
+        if group:
+            packed.append({
+                "src": "\n\n".join(b["src"] for b in group), "fixed": None, "kind": None,
+                "parts": len(group), "tokens": group_tokens, "oversize": group_tokens > budget,
+            })
+            group.clear()
+
+    for b in blocks:
+        if b["fixed"] is not None:
+            flush()
+            group_tokens = 0
+            packed.append(b)
+            continue
+        tokens = count_tokens(b["src"])
+        if group and group_tokens + tokens > budget:
+            flush()
+            group_tokens = 0
+        group.append(b)
+        group_tokens += tokens
+    flush()
+    return packed
+
+def packing_report(blocks: list, packed: list) -> dict:
+    # 번역 시작 전 API 호출 수와 호출마다 반복되는 시스템 프롬프트(MY_INSTRUCTION) 토큰 합계
+    system_tokens = count_tokens(MY_INSTRUCTION)
+    calls_before = sum(1 for b in blocks if b["fixed"] is None)
+    calls_after = sum(1 for b in packed if b["fixed"] is None)
+    return {
+        "calls_before": calls_before,
+        "calls_after": calls_after,
+        "system_tokens": system_tokens,
+        "overhead_before": calls_before * system_tokens,
+        "overhead_after": calls_after * system_tokens,
+        "oversize": sum(1 for b in packed if b.get("oversize")),
+    }
+
+# --- 일괄(동시) 번역 지원 ---
+class RateLimiter:
+    # 분당 요청 수(RPM) 상한에 맞춰 요청 시작 시점을 일정 간격으로 벌려 줌 (스레드 안전)
+    def __init__(self, rpm: int):
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+# --- 요청 스케줄러: 속도 제한·재시도·타임아웃·보조 모델 폴백 ---
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+def _parse_reset(value) -> float:
+    # x-ratelimit-reset-* 헤더 ("1s", "6m0s", "20ms")를 초 단위로 변환
+    if not value:
+        return 0.0
+    total = 0.0
+    for num, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        total += float(num) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total
+
+class ScheduledStream:
+    # 스케줄러가 돌려주는 스트림: 실제 사용된 모델, 재시도 횟수, 요청을 보내기 전까지 대기한 시간
+    # (RPM/TPM 간격·한도 대기·실패한 시도와 백오프)을 함께 전달
+    def __init__(self, stream, model: str, retries: int, queue_s: float = 0.0):
+        self.stream, self.model, self.retries, self.queue_s = stream, model, retries, queue_s
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def close(self):
+        self.stream.close()
+
+class RequestScheduler:
+    # client.chat.completions.create를 대신하는 래퍼 (같은 인터페이스라 기존 호출부에 그대로 끼워 넣음)
+    # - 최근 60초 요청 수/토큰 수(RPM/TPM)를 추적하고 한도 전에 대기
+    # - 응답의 x-ratelimit-* 헤더로 남은 한도를 읽어, 소진되면 초기화 시각까지 대기하거나 보조 모델로 전환
+    # - 429/5xx/타임아웃/연결 오류는 지수 백오프 + 지터로 재시도 (Retry-After 헤더 우선)
+    def __init__(self, client, rpm: int = 60, tpm: int = 0, timeout: float = 120.0, max_retries: int = 4,
+                 base_delay: float = 1.0, max_delay: float = 30.0, fallback_model: str = None):
+        self.client = client
+        self.limiter = RateLimiter(rpm)
+        self.lock = threading.Lock()
+        self.requests = deque()
+        self.tokens = deque()
+        self.rate_state = {}
+        self.consecutive_429 = defaultdict(int)
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "fallbacks": 0}
+        self.configure(rpm, tpm, timeout, max_retries, base_delay, max_delay, fallback_model)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def configure(self, rpm: int = 60, tpm: int = 0, timeout: float = 120.0, max_retries: int = 4,
+                  base_delay: float = 1.0, max_delay: float = 30.0, fallback_model: str = None):
+        self.rpm, self.tpm = rpm, tpm
+        self.timeout, self.max_retries = timeout, max_retries
+        self.base_delay, self.max_delay = base_delay, max_delay
+        self.fallback_model = fallback_model or None
+        self.limiter.interval = 60.0 / rpm if rpm > 0 else 0.0
+
+    def _count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _saturated(self, model: str) -> bool:
+        state = self.rate_state.get(model)
+        header_empty = bool(state) and time.monotonic() < state["reset_at"] and (
+            state["remaining_requests"] == 0 or state["remaining_tokens"] == 0)
+        return header_empty or self.consecutive_429[model] >= 2
+
+    def _pick_model(self, model: str) -> str:
+        if self.fallback_model and self.fallback_model != model and self._saturated(model):
+            self._count("fallbacks")
+            return self.fallback_model
+        return model
+
+    def _acquire(self, model: str, est_tokens: int):
+        self.limiter.wait()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.requests and now - self.requests[0] >= 60:
+                    self.requests.popleft()
+                while self.tokens and now - self.tokens[0][0] >= 60:
+                    self.tokens.popleft()
+                waits = []
+                if self.rpm and len(self.requests) >= self.rpm:
+                    waits.append(60 - (now - self.requests[0]))
+                if self.tpm and self.tokens and sum(t for _, t in self.tokens) + est_tokens > self.tpm:
+                    waits.append(60 - (now - self.tokens[0][0]))
+                state = self.rate_state.get(model)
+                if state and now < state["reset_at"] and (state["remaining_requests"] == 0 or state["remaining_tokens"] == 0):
+                    waits.append(state["reset_at"] - now)
+                if not waits:
+                    self.requests.append(now)
+                    self.tokens.append((now, est_tokens))
+                    self.stats["requests"] += 1
+                    return
+            time.sleep(min(max(waits), self.max_delay))
+
+    def _observe(self, model: str, headers):
+        if headers is None:
+            return
+        def as_int(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+        reset = max(_parse_reset(headers.get("x-ratelimit-reset-requests")), _parse_reset(headers.get("x-ratelimit-reset-tokens")))
+        with self.lock:
+            self.rate_state[model] = {
+                "remaining_requests": as_int("x-ratelimit-remaining-requests"),
+                "remaining_tokens": as_int("x-ratelimit-remaining-tokens"),
+                "reset_at": time.monotonic() + reset,
+            }
+
+    def _backoff(self, attempt: int, err) -> float:
+        response = getattr(err, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return min(float(retry_after), self.max_delay)
+        except (TypeError, ValueError):
+            return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def create(self, model: str, messages: list, **kwargs):
+        est_tokens = sum(count_tokens(m["content"]) for m in messages if isinstance(m["content"], str))
+        raw_api = getattr(self.client.chat.completions, "with_raw_response", None)
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            use_model = self._pick_model(model)
+            self._acquire(use_model, est_tokens)
+            sent = time.perf_counter()
+            try:
+                if raw_api is not None:
+                    raw = raw_api.create(model=use_model, messages=messages, timeout=self.timeout, **kwargs)
+                    self._observe(use_model, raw.headers)
+                    stream = raw.parse()
+                else:
+                    stream = self.client.chat.completions.create(model=use_model, messages=messages, timeout=self.timeout, **kwargs)
+                self.consecutive_429[use_model] = 0
+                return ScheduledStream(stream, use_model, attempt, sent - start)
+            except (openai.APITimeoutError, openai.APIConnectionError, openai.APIStatusError) as e:
+                status = getattr(e, "status_code", None)
+                if isinstance(e, openai.APIStatusError) and status not in RETRYABLE_STATUS:
+                    raise
+                if status == 429:
+                    self.consecutive_429[use_model] += 1
+                    self._count("rate_limited")
+                    self._observe(use_model, getattr(e.response, "headers", None))
+                elif isinstance(e, openai.APITimeoutError):
+                    self._count("timeouts")
+                if attempt == self.max_retries:
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+
+    def retry_stream(self, err, attempt: int) -> bool:
+        # 스트림을 읽는 도중 끊긴 경우: 재시도 대상이면 대기 후 True (호출부가 처음부터 다시 요청), 아니면 False
+        # 읽는 중의 타임아웃·연결 끊김은 SDK가 감싸지 않은 httpx 예외(ReadTimeout, RemoteProtocolError 등)로 올라옴
+        if isinstance(err, openai.APIStatusError):
+            retryable = err.status_code in RETRYABLE_STATUS
+        else:
+            retryable = isinstance(err, (openai.APITimeoutError, openai.APIConnectionError)) or \
+                type(err).__module__.split(".")[0] in ("httpx", "httpcore")
+        if not retryable or attempt >= self.max_retries:
+            return False
+        if isinstance(err, openai.APITimeoutError) or "Timeout" in type(err).__name__:
+            self._count("timeouts")
+        self._count("retries")
+        time.sleep(self._backoff(attempt, err))
+        return True
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                **self.stats,
+                "rpm_used": sum(1 for t in self.requests if now - t < 60),
+                "tpm_used": sum(tok for t, tok in self.tokens if now - t < 60),
+                "remaining": {m: (st["remaining_requests"], st["remaining_tokens"]) for m, st in self.rate_state.items()},
+            }
+
+# --- 번역 캐시 (SQLite, 내용 주소 기반) ---
+class TranslationCache:
+    # (블록, A_E 용어, 헤더, 지침 해시, 모델, temperature)의 해시 → 번역문
+    def __init__(self, path: str, max_entries: int = 5000, max_age_days: float = 90):
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, instr_hash TEXT, model TEXT, translation TEXT, "
+            "created_at REAL, last_used REAL)"
+        )
+        # 출원번호별 마지막 단락 구성·묶음 경계와 번역 (정정 통지서 재업로드 시 바뀐 구간만 다시 묶어 번역하기 위함)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS document_paragraphs ("
+            "app_no TEXT, position INTEGER, fingerprint TEXT, translation TEXT, parts INTEGER, updated_at REAL, "
+            "PRIMARY KEY (app_no, position))"
+        )
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(block: str, ae_context: str, header_hint: str, model: str, temperature: float) -> str:
+        payload = json.dumps([block, ae_context, header_hint, INSTRUCTION_HASH, model, temperature], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.conn.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE translations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, key: str, model: str, translation: str):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+                (key, INSTRUCTION_HASH, model, translation, now, now)
+            )
+            self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        # 오래된 항목 삭제 후, 최대 개수를 넘으면 가장 오래 안 쓰인 항목부터 삭제
+        with self.lock:
+            self.conn.execute("DELETE FROM translations WHERE created_at < ?", (time.time() - self.max_age,))
+            self.conn.execute(
+                "DELETE FROM translations WHERE key IN ("
+                "SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+    def invalidate(self, all_versions: bool = False) -> int:
+        # 기본: 현재 지침 해시가 아닌 항목만 삭제 / all_versions=True: 전체 삭제
+        with self.lock:
+            if all_versions:
+                cur = self.conn.execute("DELETE FROM translations")
+            else:
+                cur = self.conn.execute("DELETE FROM translations WHERE instr_hash != ?", (INSTRUCTION_HASH,))
+            self.conn.commit()
+            return cur.rowcount
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def load_document(self, app_no: str) -> list:
+        # [(단락 지문, 묶음 번역문 또는 None, 묶음 단락 수)] 단락 순서대로. 저장된 적 없으면 빈 목록
+        with self.lock:
+            return self.conn.execute(
+                "SELECT fingerprint, translation, parts FROM document_paragraphs WHERE app_no = ? ORDER BY position", (app_no,)
+            ).fetchall()
+
+    def save_document(self, app_no: str, fingerprints: list, blocks: list, results: dict):
+        # 현재 구성 전체로 교체. fingerprints는 단락(split) 단위, blocks·results는 묶음 단위
+        # 묶음의 번역문과 단락 수는 첫 단락 행에 두고 이어지는 단락 행은 parts=0
+        # 아직 번역하지 않은 묶음도 지문과 경계는 남겨 다음 비교에 사용
+        now = time.time()
+        rows, pos = [], 0
+        for i, b in enumerate(blocks):
+            parts = b.get("parts", 1)
+            rows += [(app_no, pos + k, fingerprints[pos + k], results.get(i) if k == 0 else None, parts if k == 0 else 0, now)
+                     for k in range(parts)]
+            pos += parts
+        with self.lock:
+            self.conn.execute("DELETE FROM document_paragraphs WHERE app_no = ?", (app_no,))
+            self.conn.executemany("INSERT INTO document_paragraphs VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+def block_fingerprint(block: str, header_hint: str = "") -> str:
+    # 공백 차이는 무시. 지침이 바뀌면 지문도 달라져 이전 번역을 재사용하지 않음
+    payload = json.dumps([" ".join(block.split()), header_hint, INSTRUCTION_HASH], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def paragraph_fingerprints(blocks: list, header_hint: str = "") -> list:
+    # 묶기 전 단락 단위 지문. 헤더 정보는 첫 번역 대상 단락(= 첫 번역 묶음의 첫 단락)에 반영
+    hint_idx = header_block_index(blocks, header_hint)
+    return [block_fingerprint(b["src"], header_hint if i == hint_idx else "") for i, b in enumerate(blocks)]
+
+def repack_blocks(blocks: list, fingerprints: list, stored: list, pack) -> tuple:
+    # 저장된 단락 순서와 새 단락 순서를 비교해, 구성 단락이 모두 그대로 이어지는 번역된 저장 묶음은 경계와 번역을 유지하고
+    # 그 사이의 나머지 단락(추가·변경 단락, 같은 묶음이던 단락, 아직 번역하지 않은 단락)만 pack으로 다시 묶음
+    # pack: 단락 목록 → 묶음 목록 (묶기 해제 시 그대로 반환). 예산이 바뀌어 한 묶음에 들지 않는 저장 묶음은 다시 묶음
+    # 반환: (묶음 목록, {묶음 번호: 번역문}, {"reused": 재사용 묶음 수, "changed", "removed": 단락 수})
+    matcher = difflib.SequenceMatcher(None, [row[0] for row in stored], fingerprints, autojunk=False)
+    moved, changed, removed = {}, 0, 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            moved.update(zip(range(i1, i2), range(j1, j2)))
+        else:
+            changed += j2 - j1
+            removed += i2 - i1
+    anchors = {}  # 새 단락 번호 → 그 단락에서 시작하는 유지 묶음 (단락 수, 번역문)
+    for i, (_, translation, parts) in enumerate(stored):
+        j = moved.get(i)
+        if parts and translation is not None and j is not None and all(moved.get(i + k) == j + k for k in range(parts)) \
+                and len(pack(blocks[j:j + parts])) == 1:
+            anchors[j] = (parts, translation)
+
+    packed, results, run, j = [], {}, [], 0
+    while j < len(blocks):
+        if j not in anchors:
+            run.append(blocks[j])
+            j += 1
+            continue
+        packed += pack(run)
+        run = []
+        parts, translation = anchors[j]
+        results[len(packed)] = translation
+        packed += pack(blocks[j:j + parts])
+        j += parts
+    packed += pack(run)
+    return packed, results, {"reused": len(results), "changed": changed, "removed": removed}
+
+def build_prompt(ae_context: str, header_hint: str, block: str) -> str:
+    prompt = f"[A_E 용어]:\n{ae_context}\n\n"
+    if header_hint:
+        prompt += f"[헤더]: {header_hint}\n\n"
+    return prompt + f"[번역대상]: {block}"
+
+def stream_completion(client, model: str, messages: list, on_delta=None, telemetry=None, label: str = "",
+                      info: dict = None) -> str:
+    # stream=True로 받아 토큰이 올 때마다 on_delta(누적 텍스트) 호출, 첫 토큰 시간(TTFT)·전체 지연·토큰 사용량을 telemetry에 기록
+    # 지연/TTFT는 실제 모델 요청부터 잰 값, 스케줄러 대기·백오프·재시도 시간은 queue_s로 따로 기록
+    # info를 넘기면 실제 응답한 모델(스케줄러의 보조 모델 전환 반영)을 info["model"]에 채움
+    start = time.perf_counter()
+    ttft, text = None, ""
+    usage, status, stream = None, "interrupted", None
+    stream_retries, call_start = 0, start
+    retry_stream = getattr(client, "retry_stream", None)  # RequestScheduler일 때만 스트림 도중 끊김을 재시도
+    try:
+        while True:
+            attempt_start = time.perf_counter()
+            stream = client.chat.completions.create(
+                model=model, messages=messages, temperature=TEMPERATURE,
+                stream=True, stream_options={"include_usage": True}
+            )
+            call_start = attempt_start + getattr(stream, "queue_s", 0.0)
+            try:
+                for chunk in stream:
+                    # include_usage: 마지막 청크(choices 비어 있음)에 토큰 사용량이 실려 옴
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - call_start
+                    text += delta
+                    if on_delta is not None:
+                        on_delta(text)
+                status = "ok"
+                break
+            except Exception as e:
+                # 받은 부분 결과는 버리고 처음부터 다시 요청
+                if retry_stream is None or not retry_stream(e, stream_retries):
+                    raise
+                stream_retries += 1
+                ttft, text, usage = None, "", None
+                if on_delta is not None:
+                    on_delta(text)
+            finally:
+                # 중단(예외/재실행) 시에도 연결을 닫아 서버 측 생성을 멈춤
+                stream.close()
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        if info is not None:
+            info["model"] = getattr(stream, "model", model)
+        if telemetry is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            telemetry.record(
+                "call", "chat.completions", block=label, status=status,
+                model=getattr(stream, "model", model), retries=getattr(stream, "retries", 0) + stream_retries,
+                latency_s=round(time.perf_counter() - call_start, 3),
+                ttft_s=round(ttft, 3) if ttft is not None else None,
+                queue_s=round(call_start - start, 3),
+                prompt_tokens=usage.prompt_tokens if usage else None,
+                completion_tokens=usage.completion_tokens if usage else None,
+                cached_tokens=getattr(details, "cached_tokens", None),
+                detail=f"{len(text)} chars",
+            )
+    return text
+
+def translate_block(client, model: str, prompt: str, on_delta=None, telemetry=None, label: str = "", info: dict = None) -> str:
+    messages = [
+        {"role": "system", "content": MY_INSTRUCTION},
+        {"role": "user", "content": prompt}
+    ]
+    return stream_completion(client, model, messages, on_delta, telemetry, label, info)
+
+def translate_cached(cache, client, model: str, ae_context: str, header_hint: str, block: str,
+                     on_delta=None, telemetry=None, label: str = "") -> str:
+    # 캐시 적중 시 API 호출 없이 반환, 미적중 시에만 호출 (속도 제한은 client 자리에 RequestScheduler를 넘겨 적용)
+    # 중단된 부분 결과는 캐시에 저장하지 않음
+    # cache=None이면 캐시 없이 항상 호출
+    key = TranslationCache.make_key(block, ae_context, header_hint, model, TEMPERATURE)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return cached
+    info = {}
+    translation = translate_block(client, model, build_prompt(ae_context, header_hint, block), on_delta, telemetry, label, info)
+    if cache is not None:
+        # 보조 모델이 응답했으면 주 모델 키가 아니라 그 모델의 키로 저장 (주 모델 번역으로 재사용되지 않도록)
+        used_model = info.get("model", model)
+        if used_model != model:
+            key = TranslationCache.make_key(block, ae_context, header_hint, used_model, TEMPERATURE)
+        cache.put(key, used_model, translation)
+    return translation
+
+def translate_all(fn, jobs: dict, max_workers: int):
+    # jobs: {블록 인덱스: 인자}. fn(인자)를 병렬 실행하고 완료 순서대로 (인덱스, 번역문, 예외)를 내보냄
+    # 소비자가 중간에 멈추면(⏹ 버튼, 재실행 등) 아직 시작하지 않은 작업은 취소하고 진행 중인 작업도 기다리지 않음
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {pool.submit(fn, job): i for i, job in jobs.items()}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                yield i, fut.result(), None
+            except Exception as e:
+                yield i, None, e
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def assemble_accum(results: dict) -> str:
+    # 완료 순서와 무관하게 블록 순서대로 이어 붙임
+    return "\n\n".join(results[i] for i in sorted(results))
+
+# --- 이미지(표/도면) 파이프라인: B_K에서 자동 추출 → 축소·재압축 → 중복 제거 → 여러 장씩 묶어 비전 요청 ---
+IMAGE_INSTRUCTION = MY_INSTRUCTION + """
+                    [이미지 번역 특별 지침 - 필수 준수]
+                    1. 영문 번역 강제: 이미지 내의 모든 국문 텍스트는 예외 없이 [지침 v2.1] 및 [A_E 명세서 용어]에 따라 반드시 '영문'으로 번역하여 출력하라. 국문을 그대로 노출하는 것은 치명적 시스템 오류로 간주한다.
+                    2. 표(Table)의 완벽 재현: Markdown 형식을 사용하여 동일한 행(Row)과 열(Column) 구조를 유지한 표로 산출하라.
+                    3. 표 내부 일대일 번역: 표 안의 모든 텍스트는 임의로 요약하거나 생략하지 않고, 원문의 내용과 일대일로 대응되도록 직역하여 삽입한다.
+                    4. 구조 유지: 셀 간 텍스트 이동, 병합, 분할, 재배치는 금지한다.
+                    5. 오직 번역된 영문 Markdown 표만 출력하라. 다른 설명은 일절 생략한다.
+                    6. 여러 이미지가 주어지면 이미지 순서대로, 각 결과 바로 앞에 `<<<IMAGE 번호>>>` 한 줄(번호는 1부터)을 단독 행으로 출력하라.
+                    """
+# 비전 모델(high detail)은 이미지를 2048px 안으로 맞춘 뒤 짧은 변을 768px로 줄여 읽으므로, 그보다 큰 해상도는 전송량만 늘림
+VISION_MAX_SIDE = 2048
+VISION_SHORT_SIDE = 768
+IMAGES_PER_REQUEST = 4
+MIN_IMAGE_SIDE = 48  # 구분선·글머리표 등 장식 이미지 제외
+_IMAGE_SPLIT_PAT = re.compile(r"^\s*<<<IMAGE\s*(\d+)>>>\s*$", re.MULTILINE)
+IMAGE_MARKER_PAT = re.compile(r"^\s*<###(TABLE|FIGURE)>\s*$", re.MULTILINE)
+
+def extract_images(data: bytes, name: str) -> list:
+    # 문서에 포함된 이미지를 본문 순서대로 [{"name", "data", "page"}] 로 반환 (page는 PDF만)
+    images = []
+    if name.lower().endswith(".docx"):
+        doc = Document(io.BytesIO(data))
+        for blip in doc.element.body.iter(qn("a:blip")):
+            part = doc.part.related_parts.get(blip.get(qn("r:embed")))
+            if part is not None:
+                images.append({"name": f"{name} #{len(images) + 1}", "data": part.blob, "page": None})
+    else:
+        for page_no, page in enumerate(PdfReader(io.BytesIO(data)).pages, start=1):
+            try:
+                page_images = page.images
+                keys = page_images.keys()
+            except Exception:
+                continue
+            for key in keys:
+                # 이미지 스트림은 꺼낼 때 디코딩됨: 디코더가 없는 형식(스캔 통지서의 JBIG2 등)은 건너뜀
+                try:
+                    img_data = page_images[key].data
+                except Exception:
+                    continue
+                images.append({"name": f"{name} p{page_no} #{len(images) + 1}", "data": img_data, "page": page_no})
+    return images
+
+def prepare_image(data: bytes) -> dict:
+    # 비전 모델이 실제로 읽는 해상도까지만 축소하고 회색조로 바꾼 뒤 PNG/JPEG 중 작은 쪽으로 재압축
+    # Word 삽입용 원본("original")은 색·해상도를 그대로 두고, Word가 읽지 못하는 형식(JPEG 2000 등)만 PNG로 변환
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    original_size = img.size
+    if img.format in ("PNG", "JPEG", "GIF", "BMP", "TIFF"):
+        original = data
+    else:
+        buf = io.BytesIO()
+        img.convert("RGBA" if "A" in img.getbands() else "RGB").save(buf, "PNG")
+        original = buf.getvalue()
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGBA", img.size, "white")
+        img = Image.alpha_composite(background, img)
+    img = img.convert("L")
+    scale = min(1.0, VISION_MAX_SIDE / max(img.size))
+    if min(img.size) * scale > VISION_SHORT_SIDE:
+        scale = VISION_SHORT_SIDE / min(img.size)
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    candidates = []
+    for fmt, mime, opts in (("PNG", "image/png", {"optimize": True}), ("JPEG", "image/jpeg", {"quality": 85, "optimize": True})):
+        buf = io.BytesIO()
+        img.save(buf, fmt, **opts)
+        candidates.append((len(buf.getvalue()), buf.getvalue(), mime))
+    _, out, mime = min(candidates)
+    return {
+        "data": out, "mime": mime, "sha": hashlib.sha256(out).hexdigest(),
+        "original_size": original_size, "size": img.size, "original_bytes": len(data), "original": original,
+    }
+
+def collect_images(raw_images: list) -> list:
+    # [{"name", "data"}] → 축소·재압축. 너무 작은 장식 이미지는 제외
+    # 표식 대응을 위해 원본 위치마다 한 항목을 남기고, 같은 내용의 반복 이미지는 처음 나온 항목의 변환 결과를 공유
+    # ("primary": 처음 나온 이미지 이름). 비전 요청은 unique_images로 처음 나온 항목만 보냄
+    seen, out = {}, []
+    for raw in raw_images:
+        try:
+            prepared = prepare_image(raw["data"])
+        except Exception:
+            continue  # PIL이 읽지 못하는 형식(예: DOCX에 포함된 EMF/WMF)
+        if min(prepared["original_size"]) < MIN_IMAGE_SIDE:
+            continue
+        first = seen.get(prepared["sha"])
+        if first is not None:
+            first["duplicates"].append(raw["name"])
+            out.append({**first, "name": raw["name"], "page": raw.get("page"), "duplicates": []})
+            continue
+        item = {**prepared, "name": raw["name"], "page": raw.get("page"), "primary": raw["name"], "duplicates": []}
+        seen[prepared["sha"]] = item
+        out.append(item)
+    return out
+
+def unique_images(images: list) -> list:
+    return [img for img in images if img["name"] == img["primary"]]
+
+def image_messages(images: list, telemetry=None) -> list:
+    content = [{"type": "text", "text": f"이미지 {len(images)}장 속 표를 각각 영문으로 번역하여 Markdown 표로 만들어줘."}]
+    stage = telemetry.stage("image_encode", detail=", ".join(img["name"] for img in images)) if telemetry else nullcontext()
+    with stage:
+        for img in images:
+            url = f"data:{img['mime']};base64,{base64.b64encode(img['data']).decode('utf-8')}"
+            content.append({"type": "image_url", "image_url": {"url": url}})
+    return [{"role": "system", "content": IMAGE_INSTRUCTION}, {"role": "user", "content": content}]
+
+def split_image_outputs(text: str, count: int) -> list:
+    # <<<IMAGE n>>> 구분 행으로 묶음 응답을 이미지별로 나눔. 구분 행이 없고 한 장이면 전체가 그 결과
+    parts = _IMAGE_SPLIT_PAT.split(text)
+    outputs = [""] * count
+    if len(parts) == 1:
+        if count == 1:
+            outputs[0] = text.strip()
+        return outputs
+    for num, body in zip(parts[1::2], parts[2::2]):
+        if 1 <= int(num) <= count:
+            outputs[int(num) - 1] = body.strip()
+    return outputs
+
+def translate_images(cache, client, model: str, images: list, on_delta=None, telemetry=None) -> dict:
+    # 이미지 목록을 IMAGES_PER_REQUEST장씩 묶어 순서대로 요청. 반환: {이미지 sha: Markdown 표}
+    # 이미지별 결과는 번역 캐시에 (이미지 해시) 키로 저장되어 같은 표는 다시 보내지 않음
+    results, pending = {}, []
+    for img in images:
+        if img["sha"] in results or any(img["sha"] == queued["sha"] for queued, _ in pending):
+            continue
+        key = TranslationCache.make_key("image:" + img["sha"], "", "", model, TEMPERATURE)
+        cached = cache.get(key) if cache is not None else None
+        if cached is not None:
+            results[img["sha"]] = cached
+        else:
+            pending.append((img, key))
+    batches = [pending[start:start + IMAGES_PER_REQUEST] for start in range(0, len(pending), IMAGES_PER_REQUEST)]
+    while batches:
+        batch = batches.pop(0)
+        info = {}
+        text = stream_completion(client, model, image_messages([img for img, _ in batch], telemetry),
+                                 on_delta=(lambda t, b=batch: on_delta(t, [img["name"] for img, _ in b])) if on_delta else None,
+                                 telemetry=telemetry, label=", ".join(img["name"] for img, _ in batch), info=info)
+        used_model = info.get("model", model)
+        for (img, key), output in zip(batch, split_image_outputs(text, len(batch))):
+            if output:
+                results[img["sha"]] = output
+                if cache is not None:
+                    if used_model != model:
+                        key = TranslationCache.make_key("image:" + img["sha"], "", "", used_model, TEMPERATURE)
+                    cache.put(key, used_model, output)
+            elif len(batch) > 1:
+                batches.append([(img, key)])  # 구분 행이 빠져 나눌 수 없는 결과는 한 장씩 다시 요청
+    return results
+
+def assign_markers(text: str, images: list) -> list:
+    # 번역문의 n번째 <###TABLE>/<###FIGURE> 표식에 본문 순서상 n번째 이미지(원본 위치 기준, 중복 포함)를 대응
+    # 반환: [(표식 종류, 이미지 또는 None)]
+    return [(kind, images[n] if n < len(images) else None) for n, kind in enumerate(IMAGE_MARKER_PAT.findall(text))]
+
+# --- Word 출력: 번역 마크업(**굵게**, 헤더 Tab 정렬, Markdown 표, <###TABLE>/<###FIGURE> 표식)을 문서 구조로 변환 ---
+TITLE_PAT = re.compile(r"^\*\*(NOTICE OF [A-Z ]+)\*\*$")
+HEADER_FIELD_PAT = re.compile(r"^([A-Z][A-Za-z. ]+:)\t(.*)$")
+HEADER_TAB_STOP = Inches(2.0)  # 헤더 항목 값의 세로 정렬 위치
+PAGE_WIDTH = Inches(6.0)
+IMAGE_DPI = 150
+
+def parse_markup(text: str) -> list:
+    # 번역문 → 문서 모델 [(종류, 값)]: title, field(항목, 값), table(행 목록), marker(TABLE/FIGURE), para
+    nodes, table = [], []
+    for line in text.splitlines() + [""]:
+        stripped = line.strip()
+        if stripped.startswith("|"):
+            cells = [c.strip() for c in stripped.strip("|").split("|")]
+            if not all(re.fullmatch(r":?-+:?", c) for c in cells):  # 머리행 구분선(---) 제외
+                table.append(cells)
+            continue
+        if table:
+            nodes.append(("table", table))
+            table = []
+        stripped = re.sub(r"^>\s?", "", stripped)  # 고정 안내 문구의 인용 표시
+        if not stripped:
+            continue
+        marker = IMAGE_MARKER_PAT.match(stripped)
+        title = TITLE_PAT.match(stripped)
+        field = HEADER_FIELD_PAT.match(line.strip(" "))
+        if marker:
+            nodes.append(("marker", marker.group(1)))
+        elif title:
+            nodes.append(("title", title.group(1)))
+        elif field:
+            nodes.append(("field", (field.group(1), field.group(2).strip())))
+        else:
+            nodes.append(("para", stripped))
+    return nodes
+
+def _add_runs(paragraph, text: str):
+    # **굵게** 구간만 굵은 run으로, 나머지는 일반 run으로
+    for i, part in enumerate(text.split("**")):
+        if part:
+            paragraph.add_run(part).bold = i % 2 == 1
+
+class DocxBuilder:
+    # 블록이 완료되는 대로 문서 끝에 이어 붙이는 Word 생성기. 블록 순서대로만 붙이므로
+    # 앞 블록이 아직 없으면 대기하고, 이미 붙인 블록이 바뀌거나(재번역) 표 번역이 달라지면 처음부터 다시 만듦
+    def __init__(self, images: list = (), tables: dict = None):
+        self.images = list(images)  # <###TABLE>/<###FIGURE> n번째 표식에 대응하는 n번째 이미지 (None이면 표식 유지)
+        self.tables = dict(tables or {})  # 이미지 이름 → 번역된 Markdown 표
+        self._reset()
+
+    def _reset(self):
+        self.doc = Document()
+        self.appended = []  # 붙인 블록 텍스트 (순서대로)
+        self.markers = 0
+        self._bytes = None
+
+    def sync(self, results: dict, tables: dict = None) -> int:
+        # results {블록 번호: 번역문} 중 새로 이어지는 블록만 추가. 반환: 추가한 블록 수
+        if tables is not None and tables != self.tables:
+            self.tables = dict(tables)
+            self._reset()
+        if any(results.get(i) != text for i, text in enumerate(self.appended)):
+            self._reset()
+        added = 0
+        while len(self.appended) in results:
+            text = results[len(self.appended)]
+            for kind, value in parse_markup(text):
+                self._render(kind, value)
+            self.appended.append(text)
+            added += 1
+        if added:
+            self._bytes = None
+        return added
+
+    def _render(self, kind: str, value):
+        if kind == "title":
+            p = self.doc.add_paragraph()
+            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            p.add_run(value).bold = True
+        elif kind == "field":
+            p = self.doc.add_paragraph()
+            p.paragraph_format.tab_stops.add_tab_stop(HEADER_TAB_STOP)
+            _add_runs(p, f"{value[0]}\t{value[1]}")
+        elif kind == "table":
+            self._add_table(value)
+        elif kind == "marker":
+            self._add_marker(value)
+        else:
+            _add_runs(self.doc.add_paragraph(), value)
+
+    def _add_table(self, rows: list):
+        cols = max(len(r) for r in rows)
+        table = self.doc.add_table(rows=len(rows), cols=cols)
+        table.style = "Table Grid"
+        for r, row in enumerate(rows):
+            for c, cell in enumerate(row):
+                target = table.cell(r, c).paragraphs[0]
+                _add_runs(target, cell)
+                if r == 0:
+                    for run in target.runs:
+                        run.bold = True
+
+    def _add_marker(self, kind: str):
+        # 표 번역이 있으면 Word 표로, 없으면(도면 포함) 이미지 자체를 삽입. 대응 이미지가 없으면 표식을 그대로 남김
+        img = self.images[self.markers] if self.markers < len(self.images) else None
+        self.markers += 1
+        if img is None:
+            self.doc.add_paragraph(f"<###{kind}>")
+            return
+        translated = self.tables.get(img["primary"])  # 표 번역은 처음 나온 이미지 이름으로 저장
+        if translated:
+            for node_kind, value in parse_markup(translated):
+                if node_kind != "marker":
+                    self._render(node_kind, value)
+            return
+        self.doc.add_picture(io.BytesIO(img["original"]), width=min(PAGE_WIDTH, Inches(img["original_size"][0] / IMAGE_DPI)))
+
+    @property
+    def serialized(self) -> bool:
+        return self._bytes is not None
+
+    def to_bytes(self) -> bytes:
+        # 마지막 변경 이후 한 번만 직렬화하고 재사용
+        if self._bytes is None:
+            buf = io.BytesIO()
+            self.doc.save(buf)
+            self._bytes = buf.getvalue()
+        return self._bytes
+
+def build_docx(text: str, images: list = (), tables: dict = None) -> bytes:
+    builder = DocxBuilder(images, tables)
+    builder.sync({0: text})
+    return builder.to_bytes()
+
+# --- 헤더 필드 자동 추출 (일괄 처리용: 화면 입력 대신 B_K 원문/A_E에서 추출) ---
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+           "August", "September", "October", "November", "December"]
+
+def _english_date(label: str, text: str) -> str:
+    m = re.search(label + r"\s*:?\s*(\d{4})\s*[.\-년]\s*(\d{1,2})\s*[.\-월]\s*(\d{1,2})", text)
+    if not m:
+        return ""
+    year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    return f"{_MONTHS[month - 1]} {day:02d}, {year}" if 1 <= month <= 12 else ""
+
+def extract_header_fields(raw_bk: str, ae_text: str) -> dict:
+    # preclean_bk가 출원번호를 지우므로 반드시 전처리 전 원문을 넘길 것
+    app_no = re.search(r"\d{2}-\d{4}-\d{7}", raw_bk)
+    applicant = re.search(r"출\s*원\s*인\s*(?:성명|명칭)?\s*:?\s*(.+)", raw_bk)
+    title = next((line.strip() for line in ae_text.splitlines() if line.strip()), "")
+    return {
+        "mail_date": _english_date(r"발\s*송\s*일\s*자", raw_bk),
+        "due_date": _english_date(r"제\s*출\s*기\s*일", raw_bk),
+        "applicant": applicant.group(1).strip() if applicant else "",
+        "app_no": app_no.group(0) if app_no else "",
+        "title_inv": title,
+    }
+
+# --- 비용 계산 (USD / 1M 토큰: 입력, 출력) ---
+MODEL_PRICING = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, pricing: dict = None) -> float:
+    price_in, price_out = (pricing or MODEL_PRICING).get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+# --- 오프라인 테스트용 OpenAI 클라이언트 대역 ---
+class StubClient:
+    # client.chat.completions.create(..., stream=True)만 흉내 냄. 번역 대상 원문 앞에 "[STUB]"을 붙여 그대로 돌려줌
+    # - latency: 첫 토큰까지 지연(초), jitter: 지연의 ±비율, chunk_delay: 스트리밍 조각 사이 지연(초)
+    # - rate_limit_every: n번째 호출마다 429(RateLimitError, Retry-After: retry_after초) 발생 (0=없음)
+    def __init__(self, latency: float = 0.0, chunk_chars: int = 40, chunk_delay: float = 0.0, jitter: float = 0.0,
+                 rate_limit_every: int = 0, retry_after: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        with self.lock:
+            self.calls += 1
+            throttled = self.rate_limit_every and self.calls % self.rate_limit_every == 0
+            self.rate_limited += bool(throttled)
+            delay = self.latency * (1 + self.random.uniform(-self.jitter, self.jitter))
+        if throttled:
+            response = SimpleNamespace(status_code=429, headers={"retry-after": str(self.retry_after)}, request=None)
+            raise openai.RateLimitError("Rate limit reached (stub)", response=response, body=None)
+        content = messages[-1]["content"]
+        if not isinstance(content, str):
+            content = " ".join(part.get("text", "") for part in content)
+        text = "[STUB] " + content.split("[번역대상]:", 1)[-1].strip()
+        usage = SimpleNamespace(
+            prompt_tokens=sum(count_tokens(m["content"]) for m in messages if isinstance(m["content"], str)),
+            completion_tokens=count_tokens(text),
+        )
+        time.sleep(delay)
+        if not stream:
+            message = SimpleNamespace(content=text)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+        return _StubStream(text, self.chunk_chars, usage, self.chunk_delay)
+
+class _StubStream:
+    def __init__(self, text: str, chunk_chars: int, usage, chunk_delay: float = 0.0):
+        self.text, self.chunk_chars, self.usage, self.chunk_delay = text, chunk_chars, usage, chunk_delay
+
+    def __iter__(self):
+        for i in range(0, len(self.text), self.chunk_chars):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            delta = SimpleNamespace(content=self.text[i:i + self.chunk_chars])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        pass
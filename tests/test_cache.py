@@ -0,0 +1,42 @@
+import time
+
+from pipeline import INSTRUCTION_HASH, TranslationCache
+
+
+def test_evicts_least_recently_used_beyond_max_entries(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache.db"), max_entries=2)
+    cache.put("a", "gpt-4o", "A")
+    time.sleep(0.01)
+    cache.put("b", "gpt-4o", "B")
+    time.sleep(0.01)
+    assert cache.get("a") == "A"  # a를 최근 사용으로 갱신
+    time.sleep(0.01)
+    cache.put("c", "gpt-4o", "C")
+    assert cache.size() == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_evicts_entries_older_than_max_age(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TranslationCache(path, max_age_days=1)
+    cache.put("new", "gpt-4o", "N")
+    with cache.lock:
+        cache.conn.execute("INSERT INTO translations VALUES ('old', ?, 'gpt-4o', 'O', ?, ?)",
+                           (INSTRUCTION_HASH, time.time() - 2 * 86400, time.time()))
+        cache.conn.commit()
+    cache.evict()
+    assert cache.get("old") is None and cache.get("new") == "N"
+
+
+def test_invalidate_removes_other_instruction_versions(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache.db"))
+    cache.put("current", "gpt-4o", "C")
+    with cache.lock:
+        cache.conn.execute("INSERT INTO translations VALUES ('stale', 'old-hash', 'gpt-4o', 'S', ?, ?)", (time.time(), time.time()))
+        cache.conn.commit()
+    assert cache.invalidate() == 1
+    assert cache.get("stale") is None and cache.get("current") == "C"
+    assert cache.invalidate(all_versions=True) == 1
+    assert cache.size() == 0
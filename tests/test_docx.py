@@ -0,0 +1,52 @@
+import io
+
+from docx import Document
+
+from pipeline import DocxBuilder, parse_markup
+
+TABLE = "| Item | **Value** |\n|:--|--:|\n| Filter layer | 12 |\n| Support layer | 14 |"
+
+
+def _read(builder: DocxBuilder):
+    return Document(io.BytesIO(builder.to_bytes()))
+
+
+def test_parse_markup_reads_table_title_fields_and_markers():
+    text = "**NOTICE OF PRELIMINARY REJECTION**\nMailing Date:\tNovember 10, 2025\n" + TABLE + "\n<###FIGURE>\nSee **claim 1**."
+    assert parse_markup(text) == [
+        ("title", "NOTICE OF PRELIMINARY REJECTION"),
+        ("field", ("Mailing Date:", "November 10, 2025")),
+        ("table", [["Item", "**Value**"], ["Filter layer", "12"], ["Support layer", "14"]]),
+        ("marker", "FIGURE"),
+        ("para", "See **claim 1**."),
+    ]
+
+
+def test_markdown_table_becomes_word_table():
+    builder = DocxBuilder()
+    builder.sync({0: "Table 1 shows:\n" + TABLE})
+    doc = _read(builder)
+    assert len(doc.tables) == 1
+    table = doc.tables[0]
+    assert [[cell.text for cell in row.cells] for row in table.rows] == [
+        ["Item", "Value"], ["Filter layer", "12"], ["Support layer", "14"]]
+    assert all(run.bold for run in table.rows[0].cells[0].paragraphs[0].runs)
+    assert not any(run.bold for run in table.rows[1].cells[0].paragraphs[0].runs)
+
+
+def test_table_marker_uses_translated_table():
+    image = {"name": "fig1.png", "primary": "fig1.png"}
+    builder = DocxBuilder([image], {"fig1.png": TABLE})
+    builder.sync({0: "As shown below.\n<###TABLE>"})
+    doc = _read(builder)
+    assert len(doc.tables) == 1 and builder.markers == 1
+    assert "<###TABLE>" not in "\n".join(p.text for p in doc.paragraphs)
+
+
+def test_blocks_are_appended_in_order_only():
+    builder = DocxBuilder()
+    assert builder.sync({1: "second"}) == 0
+    assert builder.sync({0: "first", 1: "second"}) == 2
+    assert [p.text for p in _read(builder).paragraphs] == ["first", "second"]
+    assert builder.sync({0: "first (revised)", 1: "second"}) == 2  # 이미 붙인 블록이 바뀌면 다시 만듦
+    assert [p.text for p in _read(builder).paragraphs] == ["first (revised)", "second"]
@@ -0,0 +1,20 @@
+import io
+
+from PIL import Image
+
+from pipeline import assign_markers, collect_images, unique_images
+
+
+def _png(color: str) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (400, 300), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_repeated_image_keeps_its_marker_position():
+    a, b = _png("white"), _png("navy")
+    images = collect_images([{"name": "a1", "data": a}, {"name": "a2", "data": a}, {"name": "b", "data": b}])
+    assert [img["name"] for img in unique_images(images)] == ["a1", "b"]
+    assert images[1]["primary"] == "a1"
+    placements = assign_markers("<###TABLE>\n<###TABLE>\n<###FIGURE>", images)
+    assert [img["name"] for _, img in placements] == ["a1", "a2", "b"]
@@ -0,0 +1,42 @@
+from pipeline import count_tokens, pack_blocks, packing_report
+
+PARAGRAPH = "1. 청구항 1에 기재된 필터층(12)은 인용발명 1에 개시되어 있다."
+TOKENS = count_tokens(PARAGRAPH)
+
+
+def _src(text):
+    return {"src": text, "fixed": None, "kind": None}
+
+
+def _fixed(text):
+    return {"src": text, "fixed": "**EXAMINATION RESULTS**", "kind": "heading"}
+
+
+def _pack(blocks, per_pack: int):
+    # 예산을 단락 per_pack개가 들어가고 하나 더는 넘치도록 설정
+    return pack_blocks(blocks, TOKENS * per_pack + 2, 100_000)
+
+
+def test_packs_split_only_at_paragraph_boundaries():
+    blocks = [_src(PARAGRAPH) for _ in range(5)]
+    packed = _pack(blocks, 2)
+    assert [b["parts"] for b in packed] == [2, 2, 1]
+    assert packed[0]["src"] == PARAGRAPH + "\n\n" + PARAGRAPH
+    assert "\n\n".join(b["src"] for b in packed) == "\n\n".join(b["src"] for b in blocks)
+
+
+def test_fixed_blocks_are_pack_boundaries():
+    blocks = [_src(PARAGRAPH), _fixed("[심사결과]"), _src(PARAGRAPH), _src(PARAGRAPH)]
+    packed = _pack(blocks, 3)
+    assert [b.get("parts") for b in packed] == [1, None, 2]
+    assert packed[1] is blocks[1]
+    report = packing_report(blocks, packed)
+    assert (report["calls_before"], report["calls_after"]) == (3, 2)
+
+
+def test_oversize_paragraph_is_sent_alone_and_flagged():
+    long_paragraph = " ".join([PARAGRAPH] * 4)
+    packed = _pack([_src(PARAGRAPH), _src(long_paragraph), _src(PARAGRAPH)], 2)
+    assert [b["parts"] for b in packed] == [1, 1, 1]
+    assert [b["oversize"] for b in packed] == [False, True, False]
+    assert packing_report([], packed)["oversize"] == 1
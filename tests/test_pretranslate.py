@@ -0,0 +1,36 @@
+import pytest
+
+from pipeline import header_block_index, prepare_blocks, pretranslate_bk
+
+LEAD_IN = "이 출원은 아래와 같은 거절이유가 있습니다."
+
+
+@pytest.mark.parametrize("heading", ["[심사결과]", "구체적인 거절이유", "인용발명", "보정서 제출시 참고사항", "첨 부"])
+def test_lead_in_after_heading_is_kept(heading):
+    blocks = pretranslate_bk(f"{heading}\n{LEAD_IN}\n1. 청구항 1은 신규성이 없다.\n2. 청구항 2는 진보성이 없다.")
+    assert blocks[0]["kind"] == "heading"
+    assert [b["src"] for b in blocks[1:]] == [LEAD_IN, "1. 청구항 1은 신규성이 없다.", "2. 청구항 2는 진보성이 없다."]
+    assert all(b["fixed"] is None for b in blocks[1:])
+
+
+def test_chunk_without_numbered_marker_is_one_block():
+    blocks = pretranslate_bk(f"[심사결과]\n{LEAD_IN}")
+    assert [b["src"] for b in blocks] == ["[심사결과]", LEAD_IN]
+
+
+HEADER = {"mail_date": "November 10, 2025", "due_date": "March 10, 2026", "applicant": "Hydac",
+          "app_no": "10-2022-7005098", "title_inv": "Filter"}
+
+
+def test_prepare_blocks_fills_header_unit():
+    base = pretranslate_bk("발송일자 : 2025.11.10\n이 출원에 대한 심사결과 거절이유가 있어 제출하여 주시기 바랍니다.\n1. 가")
+    split_blocks, hint = prepare_blocks(base, HEADER)
+    assert split_blocks[0]["kind"] == "header" and "Application No.:\t10-2022-7005098" in split_blocks[0]["fixed"]
+    assert hint == ""
+    assert header_block_index(split_blocks, hint) is None
+
+
+def test_prepare_blocks_hints_first_translatable_block_without_header():
+    split_blocks, hint = prepare_blocks(pretranslate_bk("[심사결과]\n1. 가\n2. 나"), HEADER)
+    assert "App No: 10-2022-7005098" in hint
+    assert header_block_index(split_blocks, hint) == 1
@@ -0,0 +1,42 @@
+from pipeline import TranslationCache, pack_blocks, paragraph_fingerprints, repack_blocks
+
+
+def _paragraphs(texts):
+    return [{"src": text, "fixed": None, "kind": None} for text in texts]
+
+
+def _pack(run):
+    return pack_blocks(run, 300, 600)
+
+
+def _save_all(tmp_path, texts):
+    cache = TranslationCache(str(tmp_path / "cache.db"))
+    split = _paragraphs(texts)
+    fingerprints = paragraph_fingerprints(split)
+    blocks, _, _ = repack_blocks(split, fingerprints, [], _pack)
+    cache.save_document("10-2024-0001234", fingerprints, blocks, {i: f"T{i}" for i in range(len(blocks))})
+    return cache, blocks
+
+
+def test_edit_repacks_only_the_changed_pack(tmp_path):
+    texts = [f"{n}. 청구항 {n}의 구성은 인용발명에 개시되어 있다." for n in range(1, 31)]
+    cache, blocks = _save_all(tmp_path, texts)
+    assert 1 < len(blocks) < len(texts)
+
+    texts[2] = texts[2].replace("개시되어", "정정되어")
+    split = _paragraphs(texts)
+    new_blocks, results, diff = repack_blocks(split, paragraph_fingerprints(split), cache.load_document("10-2024-0001234"), _pack)
+    assert [b["parts"] for b in new_blocks] == [b["parts"] for b in blocks]
+    assert sorted(set(range(len(new_blocks))) - set(results)) == [0]
+    assert results == {i: f"T{i}" for i in range(1, len(blocks))}
+    assert diff["changed"] == 1
+
+
+def test_untranslated_packs_are_not_reused(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache.db"))
+    split = _paragraphs(["1. 가", "2. 나"])
+    fingerprints = paragraph_fingerprints(split)
+    blocks, _, _ = repack_blocks(split, fingerprints, [], lambda run: run)
+    cache.save_document("A", fingerprints, blocks, {1: "B"})
+    _, results, _ = repack_blocks(split, fingerprints, cache.load_document("A"), lambda run: run)
+    assert results == {1: "B"}
@@ -0,0 +1,94 @@
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from pipeline import RequestScheduler, StubClient, Telemetry, stream_completion
+
+MESSAGES = [{"role": "user", "content": "[번역대상]: 필터층"}]
+
+
+def _rate_limit_error(retry_after: float = 0.0):
+    response = SimpleNamespace(status_code=429, headers={"retry-after": str(retry_after)}, request=None)
+    return openai.RateLimitError("Rate limit reached (test)", response=response, body=None)
+
+
+class PrimaryLimited(StubClient):
+    # 기본 모델만 계속 429, 보조 모델은 정상 응답
+    def _create(self, model: str, messages: list, **kwargs):
+        if model == "gpt-4o":
+            with self.lock:
+                self.calls += 1
+            raise _rate_limit_error()
+        return super()._create(model, messages, **kwargs)
+
+
+class ReadTimeout(Exception):
+    # 스트림을 읽는 도중 SDK가 감싸지 않고 올리는 httpx 예외 흉내
+    __module__ = "httpx._exceptions"
+
+
+class BreaksOnce(StubClient):
+    # 첫 호출의 스트림만 첫 조각 뒤에 끊김
+    def _create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        result = super()._create(model, messages, stream=stream, **kwargs)
+        if self.calls > 1:
+            return result
+
+        class Broken:
+            def __iter__(self_):
+                yield next(iter(result))
+                raise ReadTimeout("read timed out")
+
+            def close(self_):
+                pass
+        return Broken()
+
+
+def test_retries_after_429_then_succeeds():
+    stub = StubClient(chunk_chars=4, rate_limit_every=2, retry_after=0.05)
+    client = RequestScheduler(stub, rpm=6000, max_retries=2)
+    assert client.create("gpt-4o", MESSAGES, stream=True).retries == 0
+    stream = client.create("gpt-4o", MESSAGES, stream=True)
+    assert stream.retries == 1
+    assert stream.queue_s >= 0.05  # Retry-After 만큼 기다린 뒤 재요청
+    assert "".join(c.choices[0].delta.content for c in stream if c.choices) == "[STUB] 필터층"
+    assert client.snapshot()["rate_limited"] == 1 and client.snapshot()["retries"] == 1
+
+
+def test_raises_when_retries_are_exhausted():
+    stub = StubClient(rate_limit_every=1)
+    client = RequestScheduler(stub, rpm=6000, max_retries=2, base_delay=0.0)
+    with pytest.raises(openai.RateLimitError):
+        client.create("gpt-4o", MESSAGES, stream=True)
+    assert stub.calls == 3
+
+
+def test_falls_back_after_two_consecutive_429s():
+    stub = PrimaryLimited()
+    client = RequestScheduler(stub, rpm=6000, max_retries=4, base_delay=0.0, fallback_model="gpt-4o-mini")
+    info = {}
+    text = stream_completion(client, "gpt-4o", MESSAGES, info=info)
+    assert text == "[STUB] 필터층"
+    assert info["model"] == "gpt-4o-mini"
+    assert stub.calls == 3  # 기본 모델 429 두 번 → 보조 모델로 성공
+    assert client.snapshot()["fallbacks"] == 1
+
+
+def test_waits_for_tpm_window():
+    client = RequestScheduler(StubClient(), rpm=6000, tpm=100)
+    client.tokens.append((time.monotonic() - 59.8, 100))  # 0.2초 뒤에 60초 창에서 빠지는 사용량
+    stream = client.create("gpt-4o", MESSAGES, stream=True)
+    assert stream.queue_s >= 0.15
+
+
+def test_mid_stream_failure_is_retried_from_scratch():
+    stub = BreaksOnce(chunk_chars=3)
+    client = RequestScheduler(stub, rpm=6000, max_retries=2, base_delay=0.0)
+    telemetry, deltas = Telemetry(), []
+    text = stream_completion(client, "gpt-4o", MESSAGES, on_delta=deltas.append, telemetry=telemetry)
+    assert text == "[STUB] 필터층"
+    assert "" in deltas  # 재요청 전에 받은 부분 결과를 비움
+    assert telemetry.events[-1]["retries"] == 1 and telemetry.events[-1]["status"] == "ok"
+    assert client.snapshot()["timeouts"] == 1
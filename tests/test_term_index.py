@@ -0,0 +1,31 @@
+from pipeline import TermIndex
+
+
+def test_glossary_keeps_trailing_noun_phrase():
+    ae_text = (
+        "[0010] The frame connects the pleated structure 20 to the housing 22.\n"
+        "[0011] The filter layer 12 is bonded to the support layer 14.\n"
+        "[0012] FIG. 2 shows the pleated structure 20.\n"
+    )
+    glossary = TermIndex(ae_text).glossary
+    assert glossary["20"] == "pleated structure"
+    assert glossary["22"] == "housing"
+    assert glossary["12"] == "filter layer"
+    assert glossary["14"] == "support layer"
+
+
+def test_glossary_drops_verbs_inside_window():
+    glossary = TermIndex("[0001] A clip attaches the outer cover 30.").glossary
+    assert glossary["30"] == "outer cover"
+
+
+def test_claim_and_figure_numbers_are_not_reference_numerals():
+    index = TermIndex("[0001] The housing 1 holds the filter layer 3.\n[0002] The filter layer 3 is pleated.")
+    assert "[도면 부호 용어집]\n3: filter layer\n1: housing" in index.context_for("청구항1 및 도면3에 따르면 필터층(3)이", 600)
+    context = index.context_for("청구항1은 도면3에 도시되어 있다.", 600)
+    assert context.index("3: filter layer") < context.index("1: housing")  # 블록에 부호가 없으면 자주 쓰인 순
+
+
+def test_glossary_is_ordered_by_frequency():
+    glossary = TermIndex("[0001] A cap 5 and a seal 7.\n[0002] The seal 7 abuts the seal 7 seat.").glossary
+    assert list(glossary) == ["7", "5"]